@@ -0,0 +1,174 @@
+"""
+Готовые ответы для справочников тегов и ингредиентов.
+
+Полный список рендерится один раз в JSON и сохраняется в файлы вместе со
+сжатыми вариантами (gzip и, если установлен brotli, br). Воркеры читают
+файлы в память и перечитывают их только после замены файла. Справочники
+пересобираются при изменении тегов и ингредиентов.
+"""
+import gzip
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework.renderers import JSONRenderer
+
+from recipes.models import Ingredients, Tag
+
+from .serializers import IngredientsSerializer, TagsSerializer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CATALOGS = {
+    'ingredients': (Ingredients, IngredientsSerializer),
+    'tags': (Tag, TagsSerializer),
+}
+ENCODINGS = ('br', 'gzip')
+
+
+def get_catalog_path(name, encoding=None):
+    path = os.path.join(settings.CATALOG_DIR, f'{name}.json')
+    if encoding == 'gzip':
+        return f'{path}.gz'
+    if encoding == 'br':
+        return f'{path}.br'
+    return path
+
+
+def compress(content, encoding):
+    if encoding == 'gzip':
+        return gzip.compress(content, compresslevel=9, mtime=0)
+    if encoding == 'br' and brotli is not None:
+        return brotli.compress(content, quality=11)
+    return None
+
+
+def write_file(path, content):
+    directory = os.path.dirname(path)
+    with tempfile.NamedTemporaryFile(dir=directory, delete=False) as file:
+        file.write(content)
+    os.chmod(file.name, 0o644)
+    os.replace(file.name, path)
+
+
+def build_catalog(name):
+    """Рендерит справочник и сохраняет его вместе со сжатыми вариантами."""
+    model, serializer_class = CATALOGS[name]
+    content = JSONRenderer().render(
+        serializer_class(model.objects.order_by('id'), many=True).data
+    )
+    os.makedirs(settings.CATALOG_DIR, exist_ok=True)
+    for encoding in ENCODINGS:
+        compressed = compress(content, encoding)
+        if compressed is not None:
+            write_file(get_catalog_path(name, encoding), compressed)
+    # Несжатый файл записывается последним: по нему воркеры
+    # определяют, что справочник изменился.
+    write_file(get_catalog_path(name), content)
+
+
+def build_catalogs():
+    for name in CATALOGS:
+        build_catalog(name)
+
+
+class CatalogCache:
+    """Содержимое справочников в памяти воркера."""
+
+    def __init__(self):
+        self._catalogs = {}
+
+    def _version(self, name):
+        try:
+            stat = os.stat(get_catalog_path(name))
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _load(self, name, version):
+        with open(get_catalog_path(name), 'rb') as file:
+            content = file.read()
+        etag = hashlib.sha256(content).hexdigest()[:32]
+        variants = {None: (content, f'"{etag}"')}
+        for encoding in ENCODINGS:
+            try:
+                with open(get_catalog_path(name, encoding), 'rb') as file:
+                    variants[encoding] = (file.read(), f'"{etag}-{encoding}"')
+            except FileNotFoundError:
+                pass
+        self._catalogs[name] = (version, variants)
+        return variants
+
+    def get(self, name):
+        version = self._version(name)
+        if version is None:
+            build_catalog(name)
+            version = self._version(name)
+        cached = self._catalogs.get(name)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        return self._load(name, version)
+
+
+catalog_cache = CatalogCache()
+
+
+def parse_accept_encoding(header):
+    """Кодировки из заголовка Accept-Encoding с их q-значениями."""
+    qualities = {}
+    for item in header.split(','):
+        token, *params = (part.strip() for part in item.split(';'))
+        if not token:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        qualities[token.lower()] = quality
+    return qualities
+
+
+def get_accepted_encoding(request, variants):
+    """
+    Сжатие с наибольшим q среди доступных, при равных q - в порядке
+    ENCODINGS. Кодировки с q=0 не используются, * задает q для
+    не перечисленных в заголовке.
+    """
+    qualities = parse_accept_encoding(
+        request.META.get('HTTP_ACCEPT_ENCODING', '')
+    )
+    default = qualities.get('*', 0)
+    accepted, best = None, 0
+    for encoding in ENCODINGS:
+        quality = qualities.get(encoding, default)
+        if encoding in variants and quality > best:
+            accepted, best = encoding, quality
+    return accepted
+
+
+def catalog_response(request, name):
+    """Отдает справочник с учетом Accept-Encoding и If-None-Match."""
+    variants = catalog_cache.get(name)
+    encoding = get_accepted_encoding(request, variants)
+    content, etag = variants[encoding]
+    if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+    if etag in if_none_match or '*' in if_none_match:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content, content_type='application/json')
+        if encoding is not None:
+            response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
@@ -1,30 +1,73 @@
+from django.db.models import Exists, OuterRef
 from django_filters import ModelMultipleChoiceFilter
 from django_filters.rest_framework import FilterSet, filters
 
-from recipes.models import Recipe, Tag
+from recipes.models import Favorite, Recipe, ShoppingCart, Tag, TagsRecipe
 from users.models import FoodgramUser
 
+# Сортировки рецептов для параметра ordering; по умолчанию - новые первыми.
+RECIPE_ORDERINGS = {
+    'popular': ('-favorites_count', '-id'),
+}
+
 
 class RecipeFilter(FilterSet):
+    """
+    Фильтр рецептов.
+    Теги, избранное и корзина проверяются коррелированными EXISTS,
+    поэтому рецепты не дублируются и DISTINCT не нужен.
+    ordering=popular сортирует по счетчику Recipe.favorites_count.
+    """
     tags = ModelMultipleChoiceFilter(
         field_name='tags__slug',
         to_field_name='slug',
-        queryset=Tag.objects.all()
+        queryset=Tag.objects.all(),
+        method='filter_tags'
     )
     is_favorited = filters.BooleanFilter(method='favorited')
     is_in_shopping_cart = filters.BooleanFilter(method='in_shopping_cart')
     author = filters.ModelChoiceFilter(queryset=FoodgramUser.objects.all())
+    ordering = filters.ChoiceFilter(
+        choices=[(name, name) for name in RECIPE_ORDERINGS],
+        method='order'
+    )
+
+    def filter_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        return queryset.filter(
+            Exists(
+                TagsRecipe.objects.filter(
+                    recipe=OuterRef('pk'), tags__in=value
+                )
+            )
+        )
 
     def favorited(self, queryset, name, value):
         if self.request.user.is_authenticated and value:
-            return queryset.filter(is_favorited__user=self.request.user)
+            return queryset.filter(
+                Exists(
+                    Favorite.objects.filter(
+                        user=self.request.user, recipe=OuterRef('pk')
+                    )
+                )
+            )
         return queryset
 
     def in_shopping_cart(self, queryset, name, value):
         if self.request.user.is_authenticated and value:
-            return queryset.filter(is_in_shopping_cart__user=self.request.user)
+            return queryset.filter(
+                Exists(
+                    ShoppingCart.objects.filter(
+                        user=self.request.user, recipe=OuterRef('pk')
+                    )
+                )
+            )
         return queryset
 
+    def order(self, queryset, name, value):
+        return queryset.order_by(*RECIPE_ORDERINGS[value])
+
     class Meta:
         model = Recipe
         fields = ('author', 'tags')
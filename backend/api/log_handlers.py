@@ -0,0 +1,32 @@
+import os
+from logging.handlers import RotatingFileHandler
+
+
+class ProcessRotatingFileHandler(RotatingFileHandler):
+    """
+    RotatingFileHandler с отдельным файлом на процесс: к имени файла
+    добавляется pid (slow_queries.log - slow_queries.<pid>.log).
+    Воркеры gunicorn пишут и ротируют только свои файлы и не портят
+    чужие записи. Файл выбирается при первой записи в процессе, поэтому
+    обработчик, созданный до fork, работает и в дочерних процессах.
+    """
+
+    def __init__(self, filename, *args, **kwargs):
+        kwargs['delay'] = True
+        super().__init__(filename, *args, **kwargs)
+        self.template = self.baseFilename
+        self.pid = None
+
+    def emit(self, record):
+        if self.pid != os.getpid():
+            self.acquire()
+            try:
+                if self.stream is not None:
+                    self.stream.close()
+                    self.stream = None
+                self.pid = os.getpid()
+                root, ext = os.path.splitext(self.template)
+                self.baseFilename = f'{root}.{self.pid}{ext}'
+            finally:
+                self.release()
+        super().emit(record)
@@ -0,0 +1,106 @@
+"""
+Метрики API в формате Prometheus.
+
+Задержка, статусы ответов и число запросов к БД собираются по маршрутам
+(имена из api/urls.py, например recipes-list). Под gunicorn каждый воркер
+пишет значения в mmap-файлы каталога PROMETHEUS_MULTIPROC_DIR, а /api/metrics/
+суммирует их по всем воркерам. Размеры таблиц считаются в момент запроса.
+"""
+import os
+
+from django.db import connection
+from prometheus_client import (CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess)
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import REGISTRY
+
+from recipes.models import Favorite, ShoppingCart, Subsription
+
+REQUEST_DURATION = Histogram(
+    'foodgram_request_duration_seconds',
+    'Время обработки запроса.',
+    ('route', 'method'),
+)
+REQUESTS = Counter(
+    'foodgram_requests',
+    'Число обработанных запросов.',
+    ('route', 'method', 'status'),
+)
+DB_QUERIES = Histogram(
+    'foodgram_request_db_queries',
+    'Число запросов к БД за один запрос к API.',
+    ('route',),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, float('inf')),
+)
+DB_DURATION = Counter(
+    'foodgram_db_duration_seconds',
+    'Суммарное время запросов к БД.',
+    ('route',),
+)
+TABLES = {
+    'shopping_cart': ShoppingCart,
+    'favorite': Favorite,
+    'subscription': Subsription,
+}
+
+
+def get_route(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unresolved'
+
+
+def observe_request(request, response, duration, queries=None):
+    route = get_route(request)
+    REQUEST_DURATION.labels(route, request.method).observe(duration)
+    REQUESTS.labels(route, request.method, response.status_code).inc()
+    if queries is not None:
+        DB_QUERIES.labels(route).observe(queries.count)
+        DB_DURATION.labels(route).inc(queries.duration)
+
+
+def get_table_sizes():
+    """
+    В PostgreSQL берется оценка из статистики планировщика, чтобы не
+    выполнять COUNT(*) по большим таблицам при каждом опросе.
+    """
+    sizes = {}
+    if connection.vendor == 'postgresql':
+        tables = {model._meta.db_table: name for name, model in TABLES.items()}
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT relname, reltuples FROM pg_class '
+                'WHERE relname = ANY(%s) AND relkind = %s',
+                (list(tables), 'r')
+            )
+            for table, rows in cursor.fetchall():
+                if rows >= 0:
+                    sizes[tables[table]] = rows
+    for name, model in TABLES.items():
+        if name not in sizes:
+            sizes[name] = model.objects.count()
+    return sizes
+
+
+class TableSizeCollector:
+    def collect(self):
+        gauge = GaugeMetricFamily(
+            'foodgram_table_rows',
+            'Число строк в таблице (оценка в PostgreSQL).',
+            labels=('table',),
+        )
+        for name, rows in get_table_sizes().items():
+            gauge.add_metric((name,), rows)
+        yield gauge
+
+
+table_registry = CollectorRegistry(auto_describe=False)
+table_registry.register(TableSizeCollector())
+
+
+def render_metrics():
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry) + generate_latest(table_registry)
@@ -0,0 +1,403 @@
+"""
+Замеры времени обработки запросов.
+
+Для каждого запроса считаются общее время, число и время запросов к БД.
+Результат пишется в лог api.timing с именем представления и действия,
+например RecipeViewSet.list, и отдается в заголовке Server-Timing:
+всем - общее время, администраторам или с SERVER_TIMING_DETAILS - также
+замеры БД и этапов. Для доли запросов SERVER_TIMING_SAMPLE_RATE
+дополнительно замеряется время работы представления, рендеринга ответа
+и сериализации в представлениях с SerializerTimingMixin.
+MetricsMiddleware передает те же замеры в метрики Prometheus,
+ProfilingMiddleware по запросу администратора профилирует один запрос.
+SlowQueryMiddleware записывает медленные запросы к БД и ограничивает
+время их выполнения.
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import re
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.request import Request
+
+from .metrics import observe_request
+from .queries import QueryCounter, SlowQueryLog, is_query_canceled
+
+logger = logging.getLogger('api.timing')
+
+
+class RequestTiming:
+    """Замеры одного запроса, доступны как request.timing."""
+
+    def __init__(self, sampled):
+        self.sampled = sampled
+        self.view_name = 'unresolved'
+        self.queries = QueryCounter()
+        self.total = 0
+        self.view = None
+        self.serializer = 0
+        self.render = None
+        self.started = time.perf_counter()
+        self.view_started = None
+
+    def as_header(self, details=False):
+        metrics = [f'total;dur={self.total * 1000:.1f}']
+        if not details:
+            return metrics[0]
+        metrics.insert(
+            0,
+            f'db;dur={self.queries.duration * 1000:.1f};'
+            f'desc="{self.queries.count} queries"'
+        )
+        if self.sampled:
+            for name in ('view', 'serializer', 'render'):
+                value = getattr(self, name)
+                if value is not None:
+                    metrics.append(f'{name};dur={value * 1000:.1f}')
+        return ', '.join(metrics)
+
+    def as_log_fields(self):
+        fields = {
+            'view': self.view_name,
+            'total_ms': round(self.total * 1000, 1),
+            'db_queries': self.queries.count,
+            'db_ms': round(self.queries.duration * 1000, 1),
+        }
+        if self.sampled:
+            for name in ('view', 'serializer', 'render'):
+                value = getattr(self, name)
+                if value is not None:
+                    fields[f'{name}_ms'] = round(value * 1000, 1)
+        return fields
+
+
+def get_view_name(request, view_func):
+    """Имя представления DRF с действием или имя функции."""
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return getattr(view_func, '__qualname__', repr(view_func))
+    method = request.method.lower()
+    actions = getattr(view_func, 'actions', None) or {}
+    return f'{cls.__name__}.{actions.get(method, method)}'
+
+
+def wrap_stream(response, wrapper=None, finish=None):
+    """
+    Поток ответа выполняется после выхода из middleware: при чтении
+    каждой части снова подключается обертка запросов к БД wrapper, а
+    после чтения или закрытия потока вызывается finish.
+    """
+    content = response.streaming_content
+
+    def stream():
+        try:
+            iterator = iter(content)
+            while True:
+                if wrapper is None:
+                    chunk = next(iterator, None)
+                else:
+                    with connection.execute_wrapper(wrapper):
+                        chunk = next(iterator, None)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            if finish is not None:
+                finish()
+
+    response.streaming_content = stream()
+
+
+class TimedSerializer:
+    """
+    Обертка сериализатора: время обращения к data суммируется в
+    timing.serializer, остальные атрибуты берутся у сериализатора.
+    """
+
+    def __init__(self, serializer, timing):
+        self._serializer = serializer
+        self._timing = timing
+
+    def __getattr__(self, name):
+        return getattr(self._serializer, name)
+
+    @property
+    def data(self):
+        started = time.perf_counter()
+        try:
+            return self._serializer.data
+        finally:
+            self._timing.serializer += time.perf_counter() - started
+
+
+class SerializerTimingMixin:
+    """
+    Замеряет в выбранных запросах время сериализации ответа:
+    сериализаторов из get_serializer и переданных в timed_serializer.
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        return self.timed_serializer(
+            super().get_serializer(*args, **kwargs)
+        )
+
+    def timed_serializer(self, serializer):
+        timing = getattr(self.request, 'timing', None)
+        if timing is None or not timing.sampled:
+            return serializer
+        return TimedSerializer(serializer, timing)
+
+
+def shows_timing_details(request):
+    """Замеры БД и этапов в заголовке видят администраторы."""
+    if settings.SERVER_TIMING_DETAILS:
+        return True
+    user = getattr(request, 'user', None)
+    return bool(user is not None and user.is_authenticated and user.is_staff)
+
+
+class ServerTimingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timing = RequestTiming(
+            random.random() < settings.SERVER_TIMING_SAMPLE_RATE
+        )
+        request.timing = timing
+        with connection.execute_wrapper(timing.queries):
+            response = self.get_response(request)
+        self.finish(timing)
+        response['Server-Timing'] = timing.as_header(
+            shows_timing_details(request)
+        )
+        if response.streaming:
+            # Запросы потока учитываются в логе, но не в заголовке:
+            # он отправляется до чтения потока.
+            wrap_stream(
+                response, timing.queries,
+                lambda: self.log(request, response, timing, streamed=True)
+            )
+        else:
+            self.log(request, response, timing)
+        return response
+
+    def finish(self, timing):
+        finished = time.perf_counter()
+        timing.total = finished - timing.started
+        if timing.view_started is not None:
+            if timing.view is None:
+                timing.view = finished - timing.view_started
+            elif timing.render is None:
+                timing.render = (
+                    finished - timing.view_started - timing.view
+                )
+
+    def log(self, request, response, timing, streamed=False):
+        if streamed:
+            timing.total = time.perf_counter() - timing.started
+        fields = timing.as_log_fields()
+        logger.info(
+            ' '.join(
+                f'{key}={value}' for key, value in (
+                    ('method', request.method),
+                    ('path', request.path),
+                    ('status', response.status_code),
+                    *fields.items(),
+                )
+            ),
+            extra=fields
+        )
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.timing.view_name = get_view_name(request, view_func)
+        request.timing.view_started = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # Вызывается сразу после представления, до рендеринга ответа DRF.
+        timing = request.timing
+        if timing.view_started is not None:
+            timing.view = time.perf_counter() - timing.view_started
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Учитывает запрос в метриках Prometheus. Стоит перед
+    ServerTimingMiddleware и использует его замеры из request.timing.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        if response.streaming:
+            # Замеры потока готовы после его чтения.
+            wrap_stream(
+                response,
+                finish=lambda: self.observe(request, response, started)
+            )
+        else:
+            self.observe(request, response, started)
+        return response
+
+    def observe(self, request, response, started):
+        timing = getattr(request, 'timing', None)
+        if timing is None:
+            observe_request(request, response, time.perf_counter() - started)
+        else:
+            observe_request(request, response, timing.total, timing.queries)
+
+
+class ProfilingMiddleware:
+    """
+    Профилирует запрос через cProfile, если администратор передал
+    заголовок X-Profile или параметр profile. Значение - список через
+    запятую: memory добавляет замер памяти через tracemalloc, summary
+    возвращает сводку вместо ответа. Иначе профиль сохраняется в
+    PROFILING_DIR, имя файла возвращается в заголовке X-Profile-File.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def get_options(self, request):
+        value = request.META.get('HTTP_X_PROFILE') or request.GET.get(
+            'profile'
+        )
+        if not value or not self.is_staff(request):
+            return None
+        return {option.strip().lower() for option in value.split(',')}
+
+    def is_staff(self, request):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return user.is_staff
+        try:
+            authenticated = TokenAuthentication().authenticate(
+                Request(request)
+            )
+        except exceptions.AuthenticationFailed:
+            return False
+        return authenticated is not None and authenticated[0].is_staff
+
+    def __call__(self, request):
+        options = self.get_options(request)
+        if options is None:
+            return self.get_response(request)
+        memory = 'memory' in options and not tracemalloc.is_tracing()
+        if memory:
+            tracemalloc.start()
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+            if response.streaming:
+                response.streaming_content = [
+                    b''.join(response.streaming_content)
+                ]
+        finally:
+            profiler.disable()
+            snapshot = tracemalloc.take_snapshot() if memory else None
+            if memory:
+                tracemalloc.stop()
+        summary = self.get_summary(profiler, snapshot)
+        if 'summary' in options or not settings.PROFILING_DIR:
+            return HttpResponse(summary, content_type='text/plain')
+        response['X-Profile-File'] = self.save(
+            request, profiler, summary
+        )
+        return response
+
+    def get_summary(self, profiler, snapshot):
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats(
+            'cumulative'
+        ).print_stats(settings.PROFILING_SUMMARY_LINES)
+        if snapshot is not None:
+            stream.write('Memory allocations by line:\n')
+            for stat in snapshot.statistics('lineno')[
+                :settings.PROFILING_SUMMARY_LINES
+            ]:
+                stream.write(f'{stat}\n')
+        return stream.getvalue()
+
+    def save(self, request, profiler, summary):
+        timing = getattr(request, 'timing', None)
+        view_name = timing.view_name if timing else request.path
+        name = '-'.join((
+            timezone.now().strftime('%Y%m%d-%H%M%S'),
+            re.sub(r'[^\w.]+', '_', view_name).strip('_'),
+            str(os.getpid()),
+        ))
+        os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+        profiler.dump_stats(
+            os.path.join(settings.PROFILING_DIR, f'{name}.prof')
+        )
+        with open(
+            os.path.join(settings.PROFILING_DIR, f'{name}.txt'), 'w'
+        ) as file:
+            file.write(summary)
+        return f'{name}.prof'
+
+
+def get_statement_timeout(request, view_name):
+    timeouts = settings.STATEMENT_TIMEOUTS
+    if view_name in timeouts:
+        return timeouts[view_name]
+    return timeouts['read' if request.method in SAFE_METHODS else 'write']
+
+
+class SlowQueryMiddleware:
+    """
+    Пишет медленные запросы к БД в лог api.slow_queries (см. SlowQueryLog)
+    и задает в PostgreSQL statement_timeout по типу запроса из
+    STATEMENT_TIMEOUTS: для представления с действием, например
+    RecipeViewSet.list, или отдельно для чтения и изменения данных.
+    Таймаут применяется перед первым запросом представления к БД.
+    Отмененный по таймауту запрос завершается ответом 503.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        os.makedirs(os.path.dirname(settings.SLOW_QUERY_LOG), exist_ok=True)
+
+    def __call__(self, request):
+        request.slow_queries = SlowQueryLog(request.path)
+        with connection.execute_wrapper(request.slow_queries):
+            response = self.get_response(request)
+        if response.streaming:
+            wrap_stream(response, request.slow_queries)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_name = get_view_name(request, view_func)
+        request.slow_queries.view_name = view_name
+        request.slow_queries.statement_timeout = get_statement_timeout(
+            request, view_name
+        )
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, DatabaseError) and is_query_canceled(
+            exception
+        ):
+            return JsonResponse(
+                {'errors': 'Запрос выполнялся слишком долго, '
+                           'попробуйте уточнить условия поиска.'},
+                status=503
+            )
+        return None
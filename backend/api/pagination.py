@@ -1,5 +1,59 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class LimitPagination(PageNumberPagination):
     page_size_query_param = 'limit'
+
+
+class RecipeCursorPagination(CursorPagination):
+    """
+    Пагинация по ключу сортировки рецептов, без COUNT и OFFSET.
+    DRF строит курсор по первому полю сортировки, поэтому она доступна
+    только для сортировки по умолчанию: created_at рецепта не меняется.
+    Счетчик favorites_count (ordering=popular) меняется между запросами,
+    и страницы повторяли бы или пропускали рецепты.
+    """
+    page_size_query_param = 'limit'
+    ordering = ('-created_at', '-id')
+
+    def get_ordering(self, request, queryset, view):
+        if request.query_params.get('ordering'):
+            raise ValidationError({
+                self.cursor_query_param: (
+                    'Параметр ordering не поддерживается вместе с cursor, '
+                    'используйте постраничную пагинацию.'
+                )
+            })
+        return self.ordering
+
+
+class RecipePagination(LimitPagination):
+    """
+    Постраничная пагинация рецептов.
+    С параметром cursor (первая страница - cursor=) переключается
+    на RecipeCursorPagination: ответ содержит next, previous и results.
+    """
+    cursor_query_param = RecipeCursorPagination.cursor_query_param
+    cursor_pagination = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_pagination = None
+        if self.cursor_query_param in request.query_params:
+            self.cursor_pagination = RecipeCursorPagination()
+            return self.cursor_pagination.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_pagination is not None:
+            return self.cursor_pagination.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        if self.cursor_pagination is not None:
+            return self.cursor_pagination.get_paginated_response_schema(
+                schema
+            )
+        return super().get_paginated_response_schema(schema)
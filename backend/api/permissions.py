@@ -1,3 +1,5 @@
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
 from rest_framework import permissions
 
 
@@ -11,3 +13,15 @@ class IsAuthorOrAdmin(permissions.IsAuthenticatedOrReadOnly):
             or request.user.is_superuser
             or obj.author == request.user
         )
+
+
+class CanViewMetrics(permissions.BasePermission):
+    """Метрики доступны администраторам и по токену METRICS_TOKEN."""
+
+    def has_permission(self, request, view):
+        if settings.METRICS_TOKEN and constant_time_compare(
+            request.META.get('HTTP_AUTHORIZATION', ''),
+            f'Bearer {settings.METRICS_TOKEN}'
+        ):
+            return True
+        return bool(request.user and request.user.is_staff)
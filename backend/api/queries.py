@@ -0,0 +1,206 @@
+"""Подсчет и запись запросов к БД через connection.execute_wrapper."""
+import json
+import logging
+import re
+import time
+
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import DatabaseError, connections, transaction
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+
+SAVEPOINT_PREFIXES = (
+    'SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT'
+)
+EXPLAINABLE_PREFIXES = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+EXPLAIN_PREFIXES = {
+    'postgresql': 'EXPLAIN ',
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+}
+# Код ошибки PostgreSQL при отмене запроса по statement_timeout.
+QUERY_CANCELED = '57014'
+
+slow_query_logger = logging.getLogger('api.slow_queries')
+
+
+class QueryCounter:
+    """
+    Считает запросы к БД и время их выполнения.
+    С ignore_savepoints=True служебные запросы вложенных транзакций
+    не учитываются: их число зависит от внешней транзакции, а не от кода.
+    """
+
+    def __init__(self, ignore_savepoints=False):
+        self.ignore_savepoints = ignore_savepoints
+        self.count = 0
+        self.duration = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if not (
+                self.ignore_savepoints
+                and sql.lstrip().upper().startswith(SAVEPOINT_PREFIXES)
+            ):
+                self.count += 1
+                self.duration += time.perf_counter() - started
+
+
+def is_query_canceled(error):
+    cause = getattr(error, '__cause__', None)
+    return getattr(cause, 'pgcode', None) == QUERY_CANCELED
+
+
+def reset_statement_timeout(sender, connection, **kwargs):
+    connection.statement_timeout = None
+    connection.local_statement_timeout = None
+
+
+connection_created.connect(reset_statement_timeout)
+
+
+def restore_statement_timeouts(**kwargs):
+    """
+    После запроса возвращает statement_timeout по умолчанию: постоянное
+    соединение не должно переносить таймаут в следующий запрос.
+    """
+    for connection in connections.all():
+        if connection.connection is None or getattr(
+            connection, 'statement_timeout', None
+        ) is None:
+            continue
+        try:
+            with connection.connection.cursor() as cursor:
+                cursor.execute('RESET statement_timeout')
+        except connection.Database.Error:
+            # Неисправное соединение закроется перед следующим запросом.
+            continue
+        connection.statement_timeout = None
+
+
+request_finished.connect(restore_statement_timeouts)
+
+
+def set_statement_timeout(connection, timeout):
+    """
+    Меняет statement_timeout соединения, только если он отличается от
+    уже установленного. Запрос выполняется курсором драйвера в обход
+    execute_wrapper и не учитывается в замерах и бюджетах запросов.
+    Вне транзакции значение задается для сессии до конца запроса.
+    Внутри транзакции - через SET LOCAL: обычный SET откатился бы
+    вместе с ней, и запомненное значение перестало бы быть верным.
+    SET LOCAL действует до конца транзакции, поэтому запомненное
+    значение сбрасывается, пока следующая транзакция не началась;
+    внутри точки сохранения значение не запоминается.
+    """
+    if connection.vendor != 'postgresql' or getattr(
+        connection, 'statement_timeout', None
+    ) == timeout:
+        return
+    local = connection.in_atomic_block
+    if local:
+        from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+        if connection.connection.get_transaction_status() == (
+            TRANSACTION_STATUS_IDLE
+        ):
+            connection.local_statement_timeout = None
+        if getattr(connection, 'local_statement_timeout', None) == timeout:
+            return
+    with connection.connection.cursor() as cursor:
+        cursor.execute(
+            f'SET {"LOCAL " if local else ""}'
+            f'statement_timeout = {int(timeout)}'
+        )
+    if local:
+        connection.local_statement_timeout = (
+            None if connection.savepoint_ids else timeout
+        )
+    else:
+        connection.statement_timeout = timeout
+
+
+def normalize_sql(sql):
+    """
+    Приводит запросы, различающиеся только значениями, к одному виду:
+    литералы и параметры заменяются на ?, списки IN - на (...).
+    """
+    sql = re.sub(r'\s+', ' ', sql).strip()
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    sql = sql.replace('%s', '?')
+    return re.sub(r'\(\?(?:, \?)*\)', '(...)', sql)
+
+
+class SlowQueryLog:
+    """
+    Пишет в лог api.slow_queries запросы дольше
+    SLOW_QUERY_THRESHOLD_MS: SQL без значений параметров, представление
+    и план выполнения. Запросы, отмененные по statement_timeout,
+    записываются без плана: транзакция после отмены уже прервана.
+    statement_timeout задается перед первым запросом, поэтому запросы
+    без обращения к БД не открывают соединение ради него.
+    """
+
+    def __init__(self, view_name):
+        self.view_name = view_name
+        self.threshold = settings.SLOW_QUERY_THRESHOLD_MS / 1000
+        self.statement_timeout = None
+        self.explaining = False
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.explaining:
+            return execute(sql, params, many, context)
+        if self.statement_timeout is not None:
+            set_statement_timeout(
+                context['connection'], self.statement_timeout
+            )
+        started = time.perf_counter()
+        try:
+            result = execute(sql, params, many, context)
+        except DatabaseError as error:
+            if is_query_canceled(error):
+                self.write(sql, time.perf_counter() - started, timeout=True)
+            raise
+        duration = time.perf_counter() - started
+        if duration >= self.threshold:
+            plan = None if many else self.explain(
+                context['connection'], sql, params
+            )
+            self.write(sql, duration, plan=plan)
+        return result
+
+    def explain(self, connection, sql, params):
+        prefix = EXPLAIN_PREFIXES.get(connection.vendor)
+        if prefix is None or not sql.lstrip().upper().startswith(
+            EXPLAINABLE_PREFIXES
+        ):
+            return None
+        self.explaining = True
+        try:
+            # Ошибка EXPLAIN откатывается до точки сохранения и не
+            # прерывает транзакцию представления.
+            with transaction.atomic(using=connection.alias):
+                with connection.cursor() as cursor:
+                    cursor.execute(prefix + sql, params)
+                    return '\n'.join(
+                        ' '.join(str(column) for column in row)
+                        for row in cursor.fetchall()
+                    )
+        except DatabaseError:
+            return None
+        finally:
+            self.explaining = False
+
+    def write(self, sql, duration, plan=None, timeout=False):
+        slow_query_logger.warning(json.dumps({
+            'time': timezone.now().isoformat(),
+            'view': self.view_name,
+            'duration_ms': round(duration * 1000, 1),
+            'timeout': timeout,
+            'sql': sql,
+            'plan': plan,
+        }, ensure_ascii=False))
@@ -0,0 +1,110 @@
+import csv
+from io import BytesIO
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework import renderers
+
+SHOPPING_LIST_TITLE = 'Список покупок'
+SHOPPING_LIST_FIELDS = ('Ингредиент', 'Количество', 'Единицы измерения')
+
+
+class Echo:
+    """Буфер для csv.writer, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListRenderer(renderers.BaseRenderer):
+    """
+    Базовый рендерер списка покупок.
+    Сам список отдается потоком через stream(), render() используется
+    только для ответов с ошибками.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            data = '\n'.join(f'{key}: {value}' for key, value in data.items())
+        return str(data).encode(self.charset or 'utf-8')
+
+    def stream(self, ingredients):
+        raise NotImplementedError
+
+    def get_content_type(self):
+        if self.charset:
+            return f'{self.media_type}; charset={self.charset}'
+        return self.media_type
+
+    def get_filename(self):
+        return f'shopping-list.{self.format}'
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, ingredients):
+        yield 'to buy:\n'
+        for item in ingredients:
+            yield (
+                f'{item["name"]}, {item["amount"]} '
+                f'{item["measurement_unit"]}\n'
+            )
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, ingredients):
+        writer = csv.writer(Echo())
+        yield writer.writerow(SHOPPING_LIST_FIELDS)
+        for item in ingredients:
+            yield writer.writerow(
+                (item['name'], item['amount'], item['measurement_unit'])
+            )
+
+
+class ShoppingListPDFRenderer(ShoppingListRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    font_name = 'ShoppingListFont'
+    font_size = 12
+    margin = 50
+
+    def register_font(self):
+        if self.font_name not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(
+                TTFont(self.font_name, settings.SHOPPING_LIST_PDF_FONT)
+            )
+
+    def stream(self, ingredients):
+        self.register_font()
+        buffer = BytesIO()
+        pdf = canvas.Canvas(buffer, pagesize=A4)
+        _, height = A4
+        line_height = self.font_size * 1.5
+        pdf.setFont(self.font_name, self.font_size + 4)
+        pdf.drawString(self.margin, height - self.margin, SHOPPING_LIST_TITLE)
+        y = height - self.margin - line_height * 2
+        pdf.setFont(self.font_name, self.font_size)
+        for item in ingredients:
+            if y < self.margin:
+                pdf.showPage()
+                pdf.setFont(self.font_name, self.font_size)
+                y = height - self.margin
+            pdf.drawString(
+                self.margin,
+                y,
+                f'{item["name"]} — {item["amount"]} '
+                f'{item["measurement_unit"]}'
+            )
+            y -= line_height
+        pdf.save()
+        yield buffer.getvalue()
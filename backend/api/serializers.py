@@ -1,12 +1,92 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import exceptions, serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
 
-from foodgram.constants import MAX_VALUE, MIN_VALUE
+from foodgram.constants import MAX_BULK_RECIPES, MAX_VALUE, MIN_VALUE
+from recipes.counters import change_counter
 from recipes.models import (Favorite, Ingredients, IngredientsRecipe, Recipe,
-                            ShoppingCart, Subsription, Tag)
+                            ShoppingCart, ShoppingListIngredient, Subsription,
+                            Tag, TagsRecipe)
 from users.models import FoodgramUser
 
 
+def get_recipes_limit(request):
+    """Возвращает значение параметра recipes_limit или None."""
+    try:
+        return int(request.GET['recipes_limit'])
+    except (KeyError, ValueError):
+        return None
+
+
+def get_subscribed_authors(request):
+    """
+    Возвращает id авторов, на которых подписан текущий пользователь.
+    Загружается один раз за запрос и хранится в самом запросе.
+    """
+    if not hasattr(request, 'subscribed_authors'):
+        request.subscribed_authors = set(
+            Subsription.objects.filter(
+                user=request.user
+            ).values_list('author_id', flat=True)
+        )
+    return request.subscribed_authors
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField для списков: после load() объекты берутся из
+    словаря, загруженного одним запросом IN, а не запросом на каждый id.
+    Сообщения об ошибках те же, что у PrimaryKeyRelatedField.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.objects = None
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+    def to_pk(self, data):
+        if isinstance(data, bool):
+            raise TypeError
+        return self.get_queryset().model._meta.pk.to_python(data)
+
+    def load(self, values):
+        pks = set()
+        for value in values:
+            try:
+                pks.add(self.to_pk(value))
+            except (TypeError, DjangoValidationError):
+                continue
+        self.objects = self.get_queryset().in_bulk(pks)
+
+    def to_internal_value(self, data):
+        if self.objects is None:
+            return super().to_internal_value(data)
+        try:
+            pk = self.to_pk(data)
+        except (TypeError, DjangoValidationError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if pk not in self.objects:
+            self.fail('does_not_exist', pk_value=data)
+        return self.objects[pk]
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            self.child_relation.load(data)
+        return super().to_internal_value(data)
+
+
 class FoodgramUserSerializer(serializers.ModelSerializer):
     """Сериализатор для модели FoodgramUser."""
     is_subscribed = serializers.SerializerMethodField()
@@ -18,22 +98,18 @@ class FoodgramUserSerializer(serializers.ModelSerializer):
         read_only_fields = ('username', 'first_name', 'last_name', 'email')
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'subscribed'):
+            return obj.subscribed
         request = self.context.get('request')
-        user_is_authenticated = request and request.user.is_authenticated
-        user_id = request.user.id
-        return bool(
-            user_is_authenticated
-            and Subsription.objects.filter(
-                author=obj.id,
-                user=user_id
-            ).exists()
-        )
+        if not (request and request.user.is_authenticated):
+            return False
+        return obj.id in get_subscribed_authors(request)
 
 
 class SubsriptionReadSerializer(FoodgramUserSerializer):
     """Сериализатор для модели Subsription."""
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField()
 
     class Meta(FoodgramUserSerializer.Meta):
         model = FoodgramUser
@@ -43,20 +119,14 @@ class SubsriptionReadSerializer(FoodgramUserSerializer):
         )
 
     def get_recipes(self, obj):
+        if hasattr(obj, 'recent_recipes'):
+            return ShortRecipeSerializer(obj.recent_recipes, many=True).data
         author_recipes = obj.recipes.all()
-        request = self.context.get('request')
-
-        if 'recipes_limit' in request.GET:
-            recipes_limit = request.GET.get('recipes_limit')
-            try:
-                author_recipes = author_recipes[:int(recipes_limit)]
-            except ValueError:
-                pass
+        recipes_limit = get_recipes_limit(self.context.get('request'))
+        if recipes_limit is not None:
+            author_recipes = author_recipes[:recipes_limit]
         return ShortRecipeSerializer(author_recipes, many=True).data
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
-
 
 class SubsriptionWriteSerializer(serializers.ModelSerializer):
     """Сериализатор для модели Subsription."""
@@ -113,9 +183,20 @@ class IngredientsRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
+class CreateUpdateIngredientsRecipeListSerializer(serializers.ListSerializer):
+    """Загружает все ингредиенты списка одним запросом до проверки."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            self.child.fields['id'].load(
+                item.get('id') for item in data if isinstance(item, dict)
+            )
+        return super().to_internal_value(data)
+
+
 class CreateUpdateIngredientsRecipeSerializer(serializers.ModelSerializer):
     """Сериализатор для модели IngredientsRecipe."""
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredients.objects.all())
+    id = BulkPrimaryKeyRelatedField(queryset=Ingredients.objects.all())
     amount = serializers.IntegerField(
         min_value=MIN_VALUE,
         max_value=MAX_VALUE,
@@ -124,6 +205,7 @@ class CreateUpdateIngredientsRecipeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Ingredients
         fields = ('id', 'amount')
+        list_serializer_class = CreateUpdateIngredientsRecipeListSerializer
 
 
 class TagsSerializer(serializers.ModelSerializer):
@@ -145,7 +227,7 @@ class RecipeSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Recipe
-        exclude = ('created_at',)
+        exclude = ('created_at', 'favorites_count')
 
     def get_image(self, obj):
         if obj.image:
@@ -153,14 +235,15 @@ class RecipeSerializer(serializers.ModelSerializer):
         return None
 
     def get_ingredients(self, obj):
-        ingredients = IngredientsRecipe.objects.filter(recipe=obj)
         serializer = IngredientsRecipeSerializer(
-            ingredients,
+            obj.ingredients_recipe.all(),
             many=True
         )
         return serializer.data
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'favorited'):
+            return obj.favorited
         user_id = self.context.get('request').user.id
         return Favorite.objects.filter(
             user=user_id,
@@ -168,6 +251,8 @@ class RecipeSerializer(serializers.ModelSerializer):
         ).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'in_shopping_cart'):
+            return obj.in_shopping_cart
         user_id = self.context.get('request').user.id
         return ShoppingCart.objects.filter(
             user=user_id,
@@ -178,7 +263,7 @@ class RecipeSerializer(serializers.ModelSerializer):
 class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
     """Сериализатор для модели Recipe."""
     author = FoodgramUserSerializer(read_only=True)
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = BulkPrimaryKeyRelatedField(
         queryset=Tag.objects.all(),
         many=True
     )
@@ -191,7 +276,7 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Recipe
-        exclude = ('created_at',)
+        exclude = ('created_at', 'favorites_count')
 
     def validate(self, data):
         image = data.get('image')
@@ -221,40 +306,103 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
             )
         return data
 
-    def ingredients_recipe_objects_create(
-            self, ingredients, recipe
-    ):
+    def set_tags(self, recipe, tags, current_tags):
+        """Удаляет убранные и добавляет новые теги рецепта."""
+        tag_ids = {tag.id for tag in tags}
+        current = {tag.id for tag in current_tags}
+        if current - tag_ids:
+            TagsRecipe.objects.filter(
+                recipe=recipe, tags_id__in=current - tag_ids
+            ).delete()
+        TagsRecipe.objects.bulk_create(
+            TagsRecipe(recipe=recipe, tags_id=tag_id)
+            for tag_id in tag_ids - current
+        )
+
+    def diff_ingredients(self, ingredients, current_rows):
+        """
+        Сравнивает ингредиенты из запроса с текущими строками рецепта.
+        Возвращает id убранных ингредиентов, строки с новым количеством
+        и количества добавленных ингредиентов по id.
+        """
+        amounts = {item['id'].id: item['amount'] for item in ingredients}
+        current = {row.ingredients_id: row for row in current_rows}
+        changed = []
+        for ingredient_id, row in current.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and amount != row.amount:
+                row.amount = amount
+                changed.append(row)
+        added = {
+            ingredient_id: amount for ingredient_id, amount in amounts.items()
+            if ingredient_id not in current
+        }
+        return current.keys() - amounts.keys(), changed, added
+
+    def set_ingredients(self, recipe, removed, changed, added):
+        """Применяет изменения: не больше одного запроса на вид изменений."""
+        if removed:
+            IngredientsRecipe.objects.filter(
+                recipe=recipe, ingredients_id__in=removed
+            ).delete()
+        IngredientsRecipe.objects.bulk_update(changed, ('amount',))
         IngredientsRecipe.objects.bulk_create(
-            [
-                IngredientsRecipe(
-                    recipe=recipe,
-                    ingredients=ingredient.get('id'),
-                    amount=ingredient.get('amount')
-                ) for ingredient in ingredients
-            ]
+            IngredientsRecipe(
+                recipe=recipe, ingredients_id=ingredient_id, amount=amount
+            ) for ingredient_id, amount in added.items()
         )
 
+    @transaction.atomic
     def create(self, validated_data):
         author = self.context.get('request').user
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
 
         recipe = Recipe.objects.create(author=author, **validated_data)
-        recipe.tags.set(tags)
-
-        self.ingredients_recipe_objects_create(ingredients, recipe)
+        self.set_tags(recipe, tags, ())
+        self.set_ingredients(recipe, *self.diff_ingredients(ingredients, ()))
+        change_counter('recipes_count', author.id)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        instance.image = validated_data.get('image', instance.image)
-        ingredients = validated_data.pop('ingredients')
-        tags = validated_data.pop('tags')
-        instance.tags.set(tags)
-        instance.ingredients.clear()
-        self.ingredients_recipe_objects_create(ingredients, instance)
+        """
+        Меняет только изменившиеся связи. Текущие теги и ингредиенты
+        берутся из предзагрузки RecipeViewSet. Списки покупок
+        пересчитываются, только если состав рецепта изменился и рецепт
+        лежит в корзинах.
+        """
+        self.set_tags(
+            instance, validated_data.pop('tags'), instance.tags.all()
+        )
+        diff = self.diff_ingredients(
+            validated_data.pop('ingredients'),
+            instance.ingredients_recipe.all()
+        )
+        if any(diff):
+            # Блокировка до проверки корзин: параллельное добавление
+            # рецепта в корзину дождется новых ингредиентов.
+            ShoppingListIngredient.objects.lock_recipes([instance.id])
+            in_carts = ShoppingCart.objects.filter(recipe=instance).exists()
+            if in_carts:
+                ShoppingListIngredient.objects.remove_recipe(instance.id)
+            self.set_ingredients(instance, *diff)
+            if in_carts:
+                ShoppingListIngredient.objects.add_recipe(instance.id)
         return super().update(instance, validated_data)
 
     def to_representation(self, instance):
+        # Связи загружаются двумя запросами при любом числе ингредиентов.
+        prefetch_related_objects(
+            (instance,),
+            'tags',
+            Prefetch(
+                'ingredients_recipe',
+                queryset=IngredientsRecipe.objects.select_related(
+                    'ingredients'
+                )
+            )
+        )
         serializer = RecipeSerializer(
             instance,
             context={'request': self.context.get('request')}
@@ -320,3 +468,15 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
             instance.recipe,
             context={'request': self.context.get('request')}
         ).data
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для группового добавления или удаления."""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=MIN_VALUE),
+        allow_empty=False,
+        max_length=MAX_BULK_RECIPES,
+    )
+
+    def validate_recipes(self, value):
+        return list(dict.fromkeys(value))
@@ -0,0 +1,53 @@
+"""
+Пересборка готовых справочников API и индекса ингредиентов после
+изменения тегов и ингредиентов: из админки, API или shell. Данные
+пересобираются после фиксации транзакции, один раз, сколько бы записей
+в ней ни изменилось. Массовые операции без сигналов (bulk_create,
+update(), COPY в load_data) пересобирают их сами.
+"""
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from recipes.ingredient_index import build_ingredient_index
+from recipes.models import Ingredients
+
+from .catalog import CATALOGS, build_catalog
+
+
+def on_commit_once(key, func, using=None):
+    """
+    Выполняет func после фиксации транзакции; повторные вызовы с тем же
+    key до выполнения не добавляют работы. Если транзакция откатится,
+    обработчик следующей транзакции выполнит func.
+    """
+    connection = transaction.get_connection(using)
+    pending = getattr(connection, 'pending_on_commit', None)
+    if pending is None:
+        pending = connection.pending_on_commit = set()
+    pending.add(key)
+
+    def run():
+        if key in pending:
+            pending.discard(key)
+            func()
+
+    transaction.on_commit(run, using=using)
+
+
+def catalog_changed(sender, using=None, raw=False, **kwargs):
+    if raw:
+        return
+    for name, (model, _) in CATALOGS.items():
+        if model is sender:
+            on_commit_once(
+                ('catalog', name), partial(build_catalog, name), using
+            )
+    if sender is Ingredients:
+        on_commit_once('ingredient_index', build_ingredient_index, using)
+
+
+for model, _ in CATALOGS.values():
+    post_save.connect(catalog_changed, sender=model)
+    post_delete.connect(catalog_changed, sender=model)
@@ -0,0 +1,224 @@
+import logging
+
+from django.db import connection
+from django.test import TestCase
+from django.urls import resolve
+from rest_framework.test import APIClient
+
+from api.queries import QueryCounter
+from recipes.models import (Favorite, Ingredients, IngredientsRecipe, Recipe,
+                            ShoppingCart, ShoppingListIngredient, Subsription,
+                            Tag, TagsRecipe)
+from users.models import FoodgramUser
+
+# Два размера страницы: число запросов не должно от них зависеть.
+PAGE_SIZES = (2, 10)
+AUTHORS = 12
+RECIPES_PER_AUTHOR = 3
+MISSING_RECIPE_ID = 2 ** 31 - 1
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Число запросов к БД в действиях API не превышает бюджета из
+    query_budgets представления и не зависит от размера страницы.
+    Запросы точек сохранения не считаются: их число зависит от
+    транзакции теста, а не от кода.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.timing_logger = logging.getLogger('api.timing')
+        cls.timing_level = cls.timing_logger.level
+        cls.timing_logger.setLevel(logging.WARNING)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.timing_logger.setLevel(cls.timing_level)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        # Основные объекты создаются по одному: bulk_create возвращает
+        # id не во всех СУБД.
+        users = [
+            FoodgramUser.objects.create(
+                username=f'budget_user_{i}',
+                email=f'budget_user_{i}@example.com',
+                first_name='budget',
+                last_name='user',
+                password='!',
+            ) for i in range(AUTHORS + 1)
+        ]
+        cls.user, authors = users[0], users[1:]
+        cls.author = authors[0]
+        cls.tag, *tags = [
+            Tag.objects.create(
+                name=f'budget_tag_{i}',
+                color=f'#0000{i:02X}',
+                slug=f'budget_tag_{i}',
+            ) for i in range(3)
+        ]
+        ingredients = [
+            Ingredients.objects.create(
+                name=f'budget_ingredient_{i}', measurement_unit='г'
+            ) for i in range(5)
+        ]
+        cls.ingredient = ingredients[0]
+        recipes = [
+            Recipe.objects.create(
+                name=f'budget_recipe_{i}',
+                text='budget',
+                cooking_time=10,
+                image='recipes/budget.png',
+                author=authors[i % AUTHORS],
+            ) for i in range(AUTHORS * RECIPES_PER_AUTHOR)
+        ]
+        cls.recipe = recipes[0]
+        IngredientsRecipe.objects.bulk_create(
+            IngredientsRecipe(recipe=recipe, ingredients=ingredient, amount=10)
+            for recipe in recipes
+            for ingredient in ingredients[:3]
+        )
+        TagsRecipe.objects.bulk_create(
+            TagsRecipe(recipe=recipe, tags=tag)
+            for recipe in recipes
+            for tag in (cls.tag, tags[0])
+        )
+        Favorite.objects.bulk_create(
+            Favorite(user=cls.user, recipe=recipe) for recipe in recipes[1:]
+        )
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=cls.user, recipe=recipe)
+            for recipe in recipes[1:]
+        )
+        Subsription.objects.bulk_create(
+            Subsription(user=cls.user, author=author)
+            for author in authors[1:]
+        )
+        ShoppingListIngredient.objects.rebuild()
+
+    def get_budget(self, method, path):
+        match = resolve(path)
+        action = match.func.actions.get(method)
+        budgets = getattr(match.func.cls, 'query_budgets', {})
+        return f'{match.func.cls.__name__}.{action}', budgets.get(action)
+
+    def count_queries(self, method, path, params, user):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        counter = QueryCounter(ignore_savepoints=True)
+        with connection.execute_wrapper(counter):
+            if method == 'get':
+                response = client.get(path, params)
+            else:
+                response = getattr(client, method)(path, params, format='json')
+            content = b''.join(response.streaming_content) if (
+                response.streaming
+            ) else response.content
+        self.assertLess(
+            response.status_code, 400,
+            f'{method.upper()} {path}: {content[:200]!r}'
+        )
+        return counter.count
+
+    def assertWithinBudget(
+        self, method, path, params=None, user=None, size_param=None
+    ):
+        """
+        Проверяет бюджет действия; с size_param - на двух размерах
+        страницы, которые должны давать одинаковое число запросов.
+        """
+        params = params or {}
+        name, budget = self.get_budget(method, path)
+        description = f'{name} {method.upper()} {path} {params}'
+        self.assertIsNotNone(budget, f'{description}: бюджет не задан')
+        sizes = PAGE_SIZES if size_param else (None,)
+        counts = [
+            self.count_queries(
+                method, path,
+                {**params, size_param: size} if size else params,
+                user
+            )
+            for size in sizes
+        ]
+        self.assertLessEqual(
+            max(counts), budget,
+            f'{description}: {counts}, превышен бюджет {budget}'
+        )
+        self.assertEqual(
+            len(set(counts)), 1,
+            f'{description}: {counts}, число запросов зависит от размера '
+            f'страницы'
+        )
+
+    def test_recipe_list(self):
+        for params, user in (
+            ({}, None),
+            ({}, self.user),
+            ({'tags': self.tag.slug}, self.user),
+            ({'author': self.author.id}, self.user),
+            ({'is_favorited': 1}, self.user),
+            ({'is_in_shopping_cart': 1}, self.user),
+        ):
+            with self.subTest(params=params, user=user):
+                self.assertWithinBudget(
+                    'get', '/api/recipes/', params, user, 'limit'
+                )
+
+    def test_recipe_detail(self):
+        self.assertWithinBudget(
+            'get', f'/api/recipes/{self.recipe.id}/', user=self.user
+        )
+
+    def test_favorite(self):
+        path = f'/api/recipes/{self.recipe.id}/favorite/'
+        self.assertWithinBudget('post', path, user=self.user)
+        self.assertWithinBudget('delete', path, user=self.user)
+
+    def test_shopping_cart(self):
+        path = f'/api/recipes/{self.recipe.id}/shopping_cart/'
+        self.assertWithinBudget('post', path, user=self.user)
+        self.assertWithinBudget('delete', path, user=self.user)
+
+    def test_bulk_favorite_and_shopping_cart(self):
+        # Несуществующий рецепт добавляет поиск рецептов к запросам.
+        bulk = {'recipes': [self.recipe.id, MISSING_RECIPE_ID]}
+        for path in ('/api/recipes/favorite/', '/api/recipes/shopping_cart/'):
+            with self.subTest(path=path):
+                self.assertWithinBudget('post', path, bulk, self.user)
+                self.assertWithinBudget('delete', path, bulk, self.user)
+
+    def test_download_shopping_cart(self):
+        self.assertWithinBudget(
+            'get', '/api/recipes/download_shopping_cart/', user=self.user
+        )
+
+    def test_users(self):
+        self.assertWithinBudget('get', '/api/users/', {}, self.user, 'limit')
+        self.assertWithinBudget(
+            'get', f'/api/users/{self.author.id}/', user=self.user
+        )
+        self.assertWithinBudget('get', '/api/users/me/', user=self.user)
+
+    def test_subscriptions(self):
+        self.assertWithinBudget(
+            'get', '/api/users/subscriptions/', {}, self.user, 'limit'
+        )
+        self.assertWithinBudget(
+            'get', '/api/users/subscriptions/', {'limit': 10}, self.user,
+            'recipes_limit'
+        )
+
+    def test_subscribe(self):
+        path = f'/api/users/{self.author.id}/subscribe/'
+        self.assertWithinBudget('post', path, user=self.user)
+        self.assertWithinBudget('delete', path, user=self.user)
+
+    def test_tags_and_ingredients(self):
+        self.assertWithinBudget('get', f'/api/tags/{self.tag.id}/')
+        self.assertWithinBudget(
+            'get', f'/api/ingredients/{self.ingredient.id}/'
+        )
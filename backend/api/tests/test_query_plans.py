@@ -0,0 +1,196 @@
+import json
+import random
+from unittest import skipUnless
+
+from django.conf import settings
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.test import TestCase
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.views import RecipeViewSet
+from recipes.models import (Favorite, Ingredients, IngredientsRecipe, Recipe,
+                            ShoppingCart, ShoppingListIngredient, Tag,
+                            TagsRecipe)
+from users.models import FoodgramUser
+
+# Таблицы, которые растут вместе с данными: по ним последовательное
+# сканирование считается регрессией.
+LARGE_TABLES = (
+    Recipe._meta.db_table,
+    IngredientsRecipe._meta.db_table,
+    TagsRecipe._meta.db_table,
+    Favorite._meta.db_table,
+    ShoppingCart._meta.db_table,
+    ShoppingListIngredient._meta.db_table,
+)
+USERS = 2000
+RECIPES = 20000
+INGREDIENTS = 2000
+TAGS = 8
+SEED = 1
+BATCH_SIZE = 5000
+
+
+@skipUnless(
+    connection.vendor == 'postgresql',
+    'Планы запросов проверяются только в PostgreSQL.'
+)
+class QueryPlanTests(TestCase):
+    """
+    Основные запросы API используют индексы. Тестовая БД наполняется
+    данными реалистичного объема, после ANALYZE планы проверяются через
+    EXPLAIN: последовательное сканирование растущей таблицы - ошибка.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(SEED)
+        users = FoodgramUser.objects.bulk_create(
+            (
+                FoodgramUser(
+                    username=f'plan_user_{i}',
+                    email=f'plan_user_{i}@example.com',
+                    first_name='plan',
+                    last_name='user',
+                    password='!',
+                ) for i in range(USERS)
+            ),
+            batch_size=BATCH_SIZE
+        )
+        tags = Tag.objects.bulk_create(
+            Tag(
+                name=f'plan_tag_{i}',
+                color=f'#0000{i:02X}',
+                slug=f'plan_tag_{i}',
+            ) for i in range(TAGS)
+        )
+        ingredients = Ingredients.objects.bulk_create(
+            (
+                Ingredients(name=f'plan_ingredient_{i}', measurement_unit='г')
+                for i in range(INGREDIENTS)
+            ),
+            batch_size=BATCH_SIZE
+        )
+        recipes = Recipe.objects.bulk_create(
+            (
+                Recipe(
+                    name=f'plan_recipe_{i}',
+                    text='plan',
+                    cooking_time=rng.randint(5, 120),
+                    image='recipes/plan.png',
+                    author=rng.choice(users),
+                ) for i in range(RECIPES)
+            ),
+            batch_size=BATCH_SIZE
+        )
+        Recipe.objects.update(
+            created_at=RawSQL("now() - id * interval '1 minute'", ())
+        )
+        IngredientsRecipe.objects.bulk_create(
+            (
+                IngredientsRecipe(
+                    recipe=recipe, ingredients=ingredient,
+                    amount=rng.randint(1, 500)
+                )
+                for recipe in recipes
+                for ingredient in rng.sample(ingredients, rng.randint(3, 12))
+            ),
+            batch_size=BATCH_SIZE
+        )
+        TagsRecipe.objects.bulk_create(
+            (
+                TagsRecipe(recipe=recipe, tags=tag)
+                for recipe in recipes
+                for tag in rng.sample(tags, rng.randint(1, 3))
+            ),
+            batch_size=BATCH_SIZE
+        )
+        relations = [
+            (user, recipe)
+            for user in users
+            for recipe in rng.sample(recipes, rng.randint(0, 20))
+        ]
+        Favorite.objects.bulk_create(
+            (Favorite(user=user, recipe=recipe) for user, recipe in relations),
+            batch_size=BATCH_SIZE
+        )
+        ShoppingCart.objects.bulk_create(
+            (
+                ShoppingCart(user=user, recipe=recipe)
+                for user, recipe in relations[::4]
+            ),
+            batch_size=BATCH_SIZE
+        )
+        ShoppingListIngredient.objects.rebuild()
+        # Статистика собирается в тестовой БД, которая затем удаляется.
+        with connection.cursor() as cursor:
+            for model in (FoodgramUser, Tag, Ingredients):
+                cursor.execute(f'ANALYZE {model._meta.db_table}')
+            for table in LARGE_TABLES:
+                cursor.execute(f'ANALYZE {table}')
+        cls.user, cls.tag, cls.recipe = users[0], tags[0], recipes[0]
+
+    def recipe_list(self, params):
+        request = Request(APIRequestFactory().get('/api/recipes/', params))
+        request.user = self.user
+        view = RecipeViewSet(
+            request=request, action='list', format_kwarg=None,
+            args=(), kwargs={}
+        )
+        queryset = view.filter_queryset(view.get_queryset())
+        return queryset[:settings.REST_FRAMEWORK['PAGE_SIZE']]
+
+    def get_queries(self):
+        return {
+            'recipe list': self.recipe_list({}),
+            'tag filter': self.recipe_list({'tags': self.tag.slug}),
+            'author filter': self.recipe_list({'author': self.user.id}),
+            'favorites filter': self.recipe_list({'is_favorited': '1'}),
+            'shopping cart filter': self.recipe_list(
+                {'is_in_shopping_cart': '1'}
+            ),
+            'shopping cart aggregation': (
+                ShoppingListIngredient.objects._cart_ingredients(
+                    [self.recipe.id], self.user.id
+                )
+            ),
+            'shopping list download': self.user.shopping_list.values(
+                'amount', 'ingredients__name', 'ingredients__measurement_unit'
+            ).order_by('ingredients__name'),
+        }
+
+    def explain(self, query):
+        if isinstance(query, tuple):
+            sql, params = query
+        else:
+            sql, params = query.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]['Plan']
+
+    def scans(self, node):
+        if 'Relation Name' in node:
+            yield node['Node Type'], node['Relation Name']
+        for child in node.get('Plans', ()):
+            yield from self.scans(child)
+
+    def test_queries_use_indexes(self):
+        for name, query in self.get_queries().items():
+            with self.subTest(query=name):
+                scans = list(self.scans(self.explain(query)))
+                seq_scans = [
+                    table for node_type, table in scans
+                    if node_type == 'Seq Scan' and table in LARGE_TABLES
+                ]
+                details = ', '.join(
+                    f'{node_type} on {table}' for node_type, table in scans
+                )
+                self.assertEqual(
+                    seq_scans, [],
+                    f'{name}: последовательное сканирование ({details})'
+                )
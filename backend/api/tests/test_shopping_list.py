@@ -0,0 +1,179 @@
+import shutil
+import tempfile
+
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from recipes.models import (Ingredients, IngredientsRecipe, Recipe,
+                            ShoppingCart, ShoppingListIngredient, Tag,
+                            TagsRecipe)
+from users.models import FoodgramUser
+
+MEDIA_ROOT = tempfile.mkdtemp()
+# Изображение 1x1 для PATCH рецепта: поле image обязательно.
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=='
+)
+PASSWORD = 'shopping-list-password'
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ShoppingListTests(TestCase):
+    """
+    Списки покупок, которые меняются по частям вместе с корзиной и
+    рецептами, совпадают с рассчитанными заново по корзинам.
+    """
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            FoodgramUser.objects.create_user(
+                username=f'shopper_{i}',
+                email=f'shopper_{i}@example.com',
+                first_name='shopper',
+                last_name='user',
+                password=PASSWORD,
+            ) for i in range(3)
+        ]
+        cls.user, cls.other_user, cls.author = cls.users
+        cls.tag = Tag.objects.create(
+            name='shopping_tag', color='#000000', slug='shopping_tag'
+        )
+        cls.ingredients = [
+            Ingredients.objects.create(
+                name=f'shopping_ingredient_{i}', measurement_unit='г'
+            ) for i in range(4)
+        ]
+        cls.recipes = [
+            Recipe.objects.create(
+                name=f'shopping_recipe_{i}',
+                text='shopping',
+                cooking_time=10,
+                image='recipes/shopping.png',
+                author=cls.author if i < 2 else cls.other_user,
+            ) for i in range(3)
+        ]
+        cls.recipe, cls.second_recipe, cls.other_recipe = cls.recipes
+        # Рецепты делят ингредиенты, чтобы суммы складывались.
+        IngredientsRecipe.objects.bulk_create(
+            IngredientsRecipe(
+                recipe=recipe, ingredients=ingredient,
+                amount=10 * (i + 1) + j
+            )
+            for i, recipe in enumerate(cls.recipes)
+            for j, ingredient in enumerate(cls.ingredients[i:i + 2])
+        )
+        TagsRecipe.objects.bulk_create(
+            TagsRecipe(recipe=recipe, tags=cls.tag) for recipe in cls.recipes
+        )
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def add_to_cart(self, user, recipe):
+        response = self.client_for(user).post(
+            f'/api/recipes/{recipe.id}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def fill_carts(self):
+        for user in (self.user, self.other_user):
+            for recipe in self.recipes:
+                self.add_to_cart(user, recipe)
+
+    def assertShoppingListsExpected(self):
+        actual = {
+            (row.user_id, row.ingredients_id): row.amount
+            for row in ShoppingListIngredient.objects.all()
+        }
+        self.assertEqual(actual, ShoppingListIngredient.objects.expected())
+
+    def test_cart_add_and_remove(self):
+        self.fill_carts()
+        self.assertShoppingListsExpected()
+        response = self.client_for(self.user).delete(
+            f'/api/recipes/{self.recipe.id}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertShoppingListsExpected()
+        response = self.client_for(self.other_user).delete(
+            '/api/recipes/shopping_cart/',
+            {'recipes': [recipe.id for recipe in self.recipes]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertShoppingListsExpected()
+        response = self.client_for(self.other_user).post(
+            '/api/recipes/shopping_cart/',
+            {'recipes': [self.recipe.id, self.other_recipe.id]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertShoppingListsExpected()
+
+    def test_cart_remove_after_drift(self):
+        self.add_to_cart(self.user, self.recipe)
+        ShoppingListIngredient.objects.filter(user=self.user).update(amount=1)
+        response = self.client_for(self.user).delete(
+            f'/api/recipes/{self.recipe.id}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(
+            ShoppingListIngredient.objects.filter(user=self.user).exists()
+        )
+
+    def test_recipe_update(self):
+        self.fill_carts()
+        first, second, third, fourth = self.ingredients
+        response = self.client_for(self.author).patch(
+            f'/api/recipes/{self.recipe.id}/',
+            {
+                'name': 'shopping_recipe_updated',
+                'text': 'shopping',
+                'cooking_time': 10,
+                'image': IMAGE,
+                'tags': [self.tag.id],
+                'ingredients': [
+                    {'id': second.id, 'amount': 7},
+                    {'id': fourth.id, 'amount': 3},
+                ],
+            },
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertSetEqual(
+            set(self.recipe.ingredients_recipe.values_list(
+                'ingredients_id', 'amount'
+            )),
+            {(second.id, 7), (fourth.id, 3)}
+        )
+        self.assertShoppingListsExpected()
+
+    def test_recipe_delete(self):
+        self.fill_carts()
+        response = self.client_for(self.author).delete(
+            f'/api/recipes/{self.recipe.id}/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertShoppingListsExpected()
+
+    def test_author_delete(self):
+        self.fill_carts()
+        response = self.client_for(self.author).delete(
+            f'/api/users/{self.author.id}/',
+            {'current_password': PASSWORD},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 204, response.content)
+        self.assertFalse(
+            ShoppingCart.objects.filter(recipe__author=self.author).exists()
+        )
+        self.assertShoppingListsExpected()
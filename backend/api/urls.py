@@ -1,8 +1,8 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .views import (FoodgramUserViewSet, IngredientsViewSet, RecipeViewSet,
-                    TagsViewSet)
+from .views import (FoodgramUserViewSet, IngredientsViewSet, MetricsView,
+                    RecipeViewSet, TagsViewSet)
 
 router = DefaultRouter()
 
@@ -31,6 +31,7 @@ router.register(
 )
 
 urlpatterns = [
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     path('', include(router.urls)),
     path('', include('djoser.urls')),
 ]
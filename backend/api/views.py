@@ -1,28 +1,47 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import (BooleanField, Exists, F, OuterRef, Prefetch,
+                              Value, Window, prefetch_related_objects)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
+from djoser import utils
 from djoser.views import UserViewSet
+from prometheus_client import CONTENT_TYPE_LATEST
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
 from rest_framework.filters import SearchFilter
 from rest_framework.permissions import (IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
 
+from recipes.counters import change_counter, change_counters, delete_users
+from recipes.ingredient_index import ingredient_index, make_key
 from recipes.models import (Favorite, Ingredients, IngredientsRecipe, Recipe,
-                            ShoppingCart, Subsription, Tag)
+                            ShoppingCart, ShoppingListIngredient, Subsription,
+                            Tag)
 from users.models import FoodgramUser
 
+from .catalog import catalog_response
 from .filters import RecipeFilter
-from .permissions import IsAuthorOrAdmin
+from .metrics import render_metrics
+from .middleware import SerializerTimingMixin
+from .pagination import RecipePagination
+from .permissions import CanViewMetrics, IsAuthorOrAdmin
+from .renderers import (ShoppingListCSVRenderer, ShoppingListPDFRenderer,
+                        ShoppingListTextRenderer)
 from .serializers import (FavoriteSerializer, IngredientsSerializer,
-                          RecipeCreateUpdateSerializer, RecipeSerializer,
-                          ShoppingCartSerializer, SubsriptionReadSerializer,
-                          SubsriptionWriteSerializer, TagsSerializer)
+                          RecipeCreateUpdateSerializer, RecipeIdsSerializer,
+                          RecipeSerializer, ShoppingCartSerializer,
+                          ShortRecipeSerializer, SubsriptionReadSerializer,
+                          SubsriptionWriteSerializer, TagsSerializer,
+                          get_recipes_limit)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
     """
     Представление модели Recipe.
     Обрабатывает все запросы с учетом прав доступа.
@@ -31,6 +50,49 @@ class RecipeViewSet(viewsets.ModelViewSet):
     permission_classes = (IsAuthorOrAdmin,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    pagination_class = RecipePagination
+    # Число запросов к БД на действие без учета аутентификации,
+    # проверяется тестами api/tests/test_query_budgets.py.
+    query_budgets = {
+        'list': 6,
+        'retrieve': 4,
+        'favorite': 3,
+        'shopping_cart': 4,
+        'favorite_bulk': 3,
+        'shopping_cart_bulk': 5,
+        'download_shopping_cart': 1,
+    }
+
+    def get_queryset(self):
+        queryset = Recipe.objects.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'ingredients_recipe',
+                queryset=IngredientsRecipe.objects.select_related(
+                    'ingredients'
+                )
+            )
+        )
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset.annotate(
+                favorited=Value(False, output_field=BooleanField()),
+                in_shopping_cart=Value(False, output_field=BooleanField())
+            )
+        return queryset.annotate(
+            favorited=Exists(
+                Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+            in_shopping_cart=Exists(
+                ShoppingCart.objects.filter(user=user, recipe=OuterRef('pk'))
+            )
+        )
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        ShoppingListIngredient.objects.remove_recipe(instance.id)
+        instance.delete()
+        change_counter('recipes_count', instance.author_id, -1)
 
     def get_serializer_class(self):
         if self.action in ('create', 'partial_update'):
@@ -38,27 +100,39 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return RecipeSerializer
 
     def add(self, serializer, request, pk):
-        serializer_add = serializer(
-            data={'user': request.user, 'recipe': pk},
-            context={'request': request}
+        """
+        Добавляет рецепт одним INSERT ... ON CONFLICT DO NOTHING. Если
+        строка не вставлена, сериализатор возвращает прежнюю ошибку:
+        рецепта нет или он уже добавлен. Если проверка прошла, связь
+        успели удалить параллельным запросом, и вставка повторяется.
+        """
+        model = serializer.Meta.model
+        while not model.objects.add(request.user.id, pk):
+            serializer(
+                data={'user': request.user, 'recipe': pk},
+                context={'request': request}
+            ).is_valid(raise_exception=True)
+
+    def added_response(self, request, pk):
+        return Response(
+            self.timed_serializer(ShortRecipeSerializer(
+                Recipe.objects.get(pk=pk), context={'request': request}
+            )).data,
+            status=status.HTTP_201_CREATED
         )
-        serializer_add.is_valid(raise_exception=True)
-        serializer_add.save()
-        return Response(serializer_add.data, status=status.HTTP_201_CREATED)
 
     def delete_rel(self, model, request, pk, name):
-        user = request.user.id
-        recipe = get_object_or_404(Recipe, pk=pk)
-        delete_cnt, _ = model.objects.filter(user=user, recipe=recipe).delete()
-        # relation = model.objects.filter(user=user, recipe=recipe).delete()
-        # delete_cnt = (*relation,)[0]
-        # print(delete_cnt)
-        if not delete_cnt:
-            return Response(
-                {'errors': f'Нельзя повторно добавить рецепт в {name}'},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        """
+        Удаляет связь одним DELETE. Рецепт ищется, только если удалять
+        было нечего, чтобы вернуть 404 или 400, как раньше.
+        """
+        if model.objects.remove(request.user.id, pk):
+            return None
+        get_object_or_404(Recipe, pk=pk)
+        return Response(
+            {'errors': f'Нельзя повторно добавить рецепт в {name}'},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
 
     @action(
         detail=True,
@@ -67,10 +141,18 @@ class RecipeViewSet(viewsets.ModelViewSet):
     )
     def favorite(self, request, pk=None):
         if self.request.method == 'POST':
-            return self.add(FavoriteSerializer, request, pk)
+            with transaction.atomic():
+                self.add(FavoriteSerializer, request, pk)
+                change_counter('favorites_count', pk)
+            return self.added_response(request, pk)
         if self.request.method == 'DELETE':
             name = 'избранного'
-            return self.delete_rel(Favorite, request, pk, name)
+            with transaction.atomic():
+                error = self.delete_rel(Favorite, request, pk, name)
+                if error is not None:
+                    return error
+                change_counter('favorites_count', pk, -1)
+            return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
     @action(
@@ -80,41 +162,137 @@ class RecipeViewSet(viewsets.ModelViewSet):
     )
     def shopping_cart(self, request, pk=None):
         if self.request.method == 'POST':
-            return self.add(ShoppingCartSerializer, request, pk)
+            with transaction.atomic():
+                self.add(ShoppingCartSerializer, request, pk)
+                ShoppingListIngredient.objects.add_recipe(
+                    pk, request.user.id
+                )
+            return self.added_response(request, pk)
         if self.request.method == 'DELETE':
             name = 'списка покупок'
-            return self.delete_rel(ShoppingCart, request, pk, name)
+            with transaction.atomic():
+                error = self.delete_rel(ShoppingCart, request, pk, name)
+                if error is not None:
+                    return error
+                ShoppingListIngredient.objects.remove_cart_recipes(
+                    [pk], request.user.id
+                )
+            return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
+    def bulk_response(self, request, recipe_ids, changed):
+        """
+        Результат по каждому id: added или already_added при добавлении,
+        removed или not_added при удалении, not_found, если рецепта нет.
+        Рецепты ищутся, только если изменились не все связи.
+        """
+        done, skipped = (
+            ('added', 'already_added') if request.method == 'POST'
+            else ('removed', 'not_added')
+        )
+        unchanged = [pk for pk in recipe_ids if pk not in changed]
+        found = set(
+            Recipe.objects.filter(pk__in=unchanged).values_list(
+                'pk', flat=True
+            )
+        ) if unchanged else set()
+        return Response([
+            {
+                'id': pk,
+                'status': done if pk in changed else (
+                    skipped if pk in found else 'not_found'
+                ),
+            }
+            for pk in recipe_ids
+        ])
+
+    def get_bulk_recipe_ids(self, request):
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['recipes']
+
+    @action(
+        detail=False,
+        methods=('post', 'delete'),
+        url_path='favorite',
+        url_name='favorite-bulk',
+        permission_classes=(IsAuthenticated,),
+    )
+    def favorite_bulk(self, request):
+        """
+        Добавляет в избранное или удаляет из него несколько рецептов
+        одним INSERT или DELETE в одной транзакции.
+        """
+        recipe_ids = self.get_bulk_recipe_ids(request)
+        with transaction.atomic():
+            if request.method == 'POST':
+                changed = Favorite.objects.add_many(
+                    request.user.id, recipe_ids
+                )
+                change_counters('favorites_count', changed)
+            else:
+                changed = Favorite.objects.remove_many(
+                    request.user.id, recipe_ids
+                )
+                change_counters('favorites_count', changed, -1)
+        return self.bulk_response(request, recipe_ids, changed)
+
+    @action(
+        detail=False,
+        methods=('post', 'delete'),
+        url_path='shopping_cart',
+        url_name='shopping-cart-bulk',
+        permission_classes=(IsAuthenticated,),
+    )
+    def shopping_cart_bulk(self, request):
+        """
+        Добавляет в корзину или удаляет из нее несколько рецептов одним
+        INSERT или DELETE в одной транзакции, список покупок меняется
+        сразу на все затронутые рецепты.
+        """
+        recipe_ids = self.get_bulk_recipe_ids(request)
+        with transaction.atomic():
+            if request.method == 'POST':
+                changed = ShoppingCart.objects.add_many(
+                    request.user.id, recipe_ids
+                )
+                ShoppingListIngredient.objects.add_recipes(
+                    list(changed), request.user.id
+                )
+            else:
+                changed = ShoppingCart.objects.remove_many(
+                    request.user.id, recipe_ids
+                )
+                ShoppingListIngredient.objects.remove_cart_recipes(
+                    list(changed), request.user.id
+                )
+        return self.bulk_response(request, recipe_ids, changed)
+
     @action(
         detail=False,
         methods=('get',),
         permission_classes=(IsAuthenticated,),
+        renderer_classes=(
+            ShoppingListTextRenderer,
+            ShoppingListCSVRenderer,
+            ShoppingListPDFRenderer,
+        ),
     )
     def download_shopping_cart(self, request):
-        shopping_cart = ShoppingCart.objects.filter(user=self.request.user)
-        recipes = [item.recipe.id for item in shopping_cart]
-        buy_list = IngredientsRecipe.objects.filter(
-            recipe__in=recipes
-        ).values(
-            'ingredients'
-        ).annotate(
-            amount=Sum('amount')
+        ingredients = request.user.shopping_list.values(
+            'amount',
+            name=F('ingredients__name'),
+            measurement_unit=F('ingredients__measurement_unit')
+        ).order_by('name', 'measurement_unit')
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients.iterator()),
+            content_type=renderer.get_content_type()
         )
-        buy_list_text = ['to buy:']
-        for item in buy_list:
-            ingredient = Ingredients.objects.get(pk=item['ingredients'])
-            amount = item['amount']
-            buy_list_text.append(
-                f'{ingredient.name}, {amount} '
-                f'{ingredient.measurement_unit}'
-            )
-            buy_list_text_file = '\n'.join(buy_list_text)
-        responce = HttpResponse(buy_list_text_file, content_type='text/plain')
-        responce['Content-Disposition'] = (
-            'attachment; filename=shopping-list.txt'
+        response['Content-Disposition'] = (
+            f'attachment; filename={renderer.get_filename()}'
         )
-        return responce
+        return response
 
 
 class CreateRecipeViewSet(viewsets.ModelViewSet):
@@ -122,27 +300,67 @@ class CreateRecipeViewSet(viewsets.ModelViewSet):
     serializer_class = RecipeCreateUpdateSerializer
 
 
-class IngredientsViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientsViewSet(SerializerTimingMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Представление модели Ingredients.
+    Полный список отдается готовым ответом из api.catalog.
+    Поиск по началу названия выполняется по индексу в памяти,
+    без индекса - через SearchFilter с тем же порядком и limit.
+    """
     pagination_class = None
     queryset = Ingredients.objects.all()
     serializer_class = IngredientsSerializer
     filter_backends = (SearchFilter,)
     search_fields = ('^name',)
+    query_budgets = {'list': 1, 'retrieve': 1}
 
+    def get_search_limit(self):
+        try:
+            limit = int(self.request.query_params['limit'])
+        except (KeyError, ValueError):
+            return None
+        return limit if limit > 0 else None
 
-class TagsViewSet(viewsets.ReadOnlyModelViewSet):
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get(api_settings.SEARCH_PARAM)
+        if name is not None:
+            limit = self.get_search_limit()
+            ingredients = ingredient_index.search(name, limit)
+            if ingredients is None:
+                ingredients = self.search_database(limit)
+            return Response(ingredients)
+        return catalog_response(request, 'ingredients')
+
+    def search_database(self, limit):
+        """Сортирует найденное по ключу индекса, затем по id."""
+        ingredients = sorted(
+            self.filter_queryset(self.get_queryset()),
+            key=lambda ingredient: (
+                make_key(ingredient.name).encode(), ingredient.id
+            )
+        )
+        return self.get_serializer(ingredients[:limit], many=True).data
+
+
+class TagsViewSet(SerializerTimingMixin, viewsets.ReadOnlyModelViewSet):
     pagination_class = None
     queryset = Tag.objects.all()
     serializer_class = TagsSerializer
+    query_budgets = {'list': 0, 'retrieve': 1}
 
-
-class FavoriteViewSet(viewsets.ModelViewSet):
-    queryset = Favorite.objects.all()
-    serializer_class = FavoriteSerializer
+    def list(self, request, *args, **kwargs):
+        return catalog_response(request, 'tags')
 
 
-class FoodgramUserViewSet(UserViewSet):
+class FoodgramUserViewSet(SerializerTimingMixin, UserViewSet):
     permission_classes = (IsAuthenticatedOrReadOnly,)
+    query_budgets = {
+        'list': 3,
+        'retrieve': 2,
+        'me': 1,
+        'subscriptions': 3,
+        'subscribe': 4,
+    }
 
     @action(
         detail=False,
@@ -150,22 +368,56 @@ class FoodgramUserViewSet(UserViewSet):
         permission_classes=(IsAuthenticated,)
     )
     def subscriptions(self, request):
-        user = self.request.user
-        subscription = Subsription.objects.select_related(
-            'author'
-        ).filter(user=user)
         queryset = FoodgramUser.objects.filter(
-            subscribers__in=subscription
-        )
-        # print(queryset)
+            subscribers__user=request.user
+        ).annotate(
+            subscribed=Value(True, output_field=BooleanField())
+        ).order_by('username')
         pages = self.paginate_queryset(queryset)
-        serializer = SubsriptionReadSerializer(
+        self.prefetch_recent_recipes(pages, request)
+        serializer = self.timed_serializer(SubsriptionReadSerializer(
             pages,
             many=True,
             context={'request': request}
-        )
+        ))
         return self.get_paginated_response(serializer.data)
 
+    def prefetch_recent_recipes(self, authors, request):
+        prefetch_related_objects(
+            authors,
+            Prefetch(
+                'recipes',
+                queryset=self.get_recent_recipes(
+                    authors, get_recipes_limit(request)
+                ),
+                to_attr='recent_recipes'
+            )
+        )
+
+    @staticmethod
+    def get_recent_recipes(authors, recipes_limit):
+        """
+        Последние recipes_limit рецептов каждого автора одним запросом:
+        рецепты нумеруются ROW_NUMBER() в пределах автора.
+        """
+        recipes = Recipe.objects.filter(author__in=authors)
+        if recipes_limit is None:
+            return recipes
+        ranked_sql, params = recipes.annotate(
+            row_number=Window(
+                expression=RowNumber(),
+                partition_by=F('author_id'),
+                order_by=(F('created_at').desc(), F('id').desc())
+            )
+        ).order_by().values('id', 'row_number').query.sql_with_params()
+        return Recipe.objects.filter(
+            id__in=RawSQL(
+                f'SELECT ranked.id FROM ({ranked_sql}) ranked '
+                f'WHERE ranked.row_number <= %s',
+                (*params, recipes_limit)
+            )
+        )
+
     @action(
         detail=True,
         methods=('post', 'delete'),
@@ -173,31 +425,58 @@ class FoodgramUserViewSet(UserViewSet):
 
     )
     def subscribe(self, request, id):
+        """
+        Подписка и отписка одним INSERT ... ON CONFLICT DO NOTHING или
+        DELETE. Автор ищется, только если строку не удалось вставить или
+        удалить, чтобы вернуть прежние ответы 404 и 400.
+        """
         user = request.user
-        author = get_object_or_404(FoodgramUser, pk=id)
 
         if self.request.method == 'POST':
-            serializer = SubsriptionWriteSerializer(
-                data={'user': user, 'author': id},
-                context={'request': request}
-            )
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
+            with transaction.atomic():
+                while not Subsription.objects.add(user.id, id):
+                    get_object_or_404(FoodgramUser, pk=id)
+                    SubsriptionWriteSerializer(
+                        data={'user': user, 'author': id},
+                        context={'request': request}
+                    ).is_valid(raise_exception=True)
+                change_counter('subscribers_count', id)
+            author = FoodgramUser.objects.annotate(
+                subscribed=Value(True, output_field=BooleanField())
+            ).get(pk=id)
+            self.prefetch_recent_recipes([author], request)
+            serializer = self.timed_serializer(SubsriptionReadSerializer(
+                author, context={'request': request}
+            ))
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         if self.request.method == 'DELETE':
-            delete_subs, _ = Subsription.objects.filter(
-                user=user,
-                author=author
-            ).delete()
-            if not delete_subs:
-                return Response(
-                    {'errors': 'Вы не подписаны на этого пользователя'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+            with transaction.atomic():
+                if not Subsription.objects.remove(user.id, id):
+                    get_object_or_404(FoodgramUser, pk=id)
+                    return Response(
+                        {'errors': 'Вы не подписаны на этого пользователя'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                change_counter('subscribers_count', id, -1)
             return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def perform_destroy(self, instance):
+        if instance == self.request.user:
+            utils.logout_user(self.request)
+        delete_users(FoodgramUser.objects.filter(pk=instance.pk))
+
     def get_permissions(self):
         if self.action == 'me':
             return (IsAuthenticated(),)
         return super().get_permissions()
+
+
+class MetricsView(APIView):
+    """Метрики в формате Prometheus, суммированные по всем воркерам."""
+    permission_classes = (CanViewMetrics,)
+
+    def get(self, request):
+        return HttpResponse(
+            render_metrics(), content_type=CONTENT_TYPE_LATEST
+        )
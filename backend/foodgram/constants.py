@@ -2,3 +2,4 @@ MAX_LENGTH_MODELS_FIELDS = 200
 MAX_LENGTH_USER_FIELDS = 150
 MIN_VALUE = 1
 MAX_VALUE = 32000
+MAX_BULK_RECIPES = 100
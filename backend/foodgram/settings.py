@@ -33,6 +33,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
+    'api.middleware.ServerTimingMiddleware',
+    'api.middleware.SlowQueryMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -40,6 +43,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'foodgram.urls'
@@ -106,6 +110,88 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 AUTH_USER_MODEL = 'users.FoodgramUser'
 
+INGREDIENT_INDEX_PATH = os.getenv(
+    'INGREDIENT_INDEX_PATH',
+    default=os.path.join(BASE_DIR, 'index', 'ingredients.idx')
+)
+
+CATALOG_DIR = os.getenv(
+    'CATALOG_DIR',
+    default=os.path.join(BASE_DIR, 'catalog')
+)
+
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
+# Доля запросов, для которых замеряется время сериализации и рендеринга.
+SERVER_TIMING_SAMPLE_RATE = float(
+    os.getenv('SERVER_TIMING_SAMPLE_RATE', default='0.1')
+)
+# Замеры БД и этапов в заголовке Server-Timing для всех, а не только
+# для администраторов.
+SERVER_TIMING_DETAILS = os.getenv(
+    'SERVER_TIMING_DETAILS', default='False'
+) == 'True'
+
+# Токен для опроса /api/metrics/ (заголовок Authorization: Bearer <токен>).
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', default='')
+
+# Каталог для профилей запросов, включаемых заголовком X-Profile;
+# если не задан, администратор получает сводку вместо ответа.
+PROFILING_DIR = os.getenv('PROFILING_DIR', default='')
+PROFILING_SUMMARY_LINES = 40
+
+# Запросы к БД дольше порога пишутся с планом выполнения в SLOW_QUERY_LOG,
+# каждым процессом в свой файл с pid в имени.
+SLOW_QUERY_THRESHOLD_MS = float(
+    os.getenv('SLOW_QUERY_THRESHOLD_MS', default='200')
+)
+SLOW_QUERY_LOG = os.getenv(
+    'SLOW_QUERY_LOG',
+    default=os.path.join(BASE_DIR, 'logs', 'slow_queries.log')
+)
+
+# statement_timeout PostgreSQL в миллисекундах (0 - без ограничения):
+# для отдельных действий API и по умолчанию для чтения и изменения данных.
+STATEMENT_TIMEOUTS = {
+    'read': int(os.getenv('STATEMENT_TIMEOUT_READ', default='5000')),
+    'write': int(os.getenv('STATEMENT_TIMEOUT_WRITE', default='15000')),
+    'RecipeViewSet.list': int(
+        os.getenv('STATEMENT_TIMEOUT_RECIPE_LIST', default='2000')
+    ),
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+        'slow_queries': {
+            'class': 'api.log_handlers.ProcessRotatingFileHandler',
+            'filename': SLOW_QUERY_LOG,
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'encoding': 'utf-8',
+        },
+    },
+    'loggers': {
+        'api.timing': {
+            'handlers': ('console',),
+            'level': os.getenv('REQUEST_LOG_LEVEL', default='INFO'),
+            'propagate': False,
+        },
+        'api.slow_queries': {
+            'handlers': ('slow_queries',),
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
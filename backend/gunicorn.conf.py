@@ -0,0 +1,23 @@
+"""
+Настройки gunicorn. Число воркеров задается переменной WEB_CONCURRENCY.
+Воркеры пишут метрики Prometheus в общий каталог, который очищается
+при запуске; файлы завершившихся воркеров помечаются как неактуальные.
+"""
+import os
+import shutil
+
+# prometheus_client выбирает способ хранения значений при импорте, поэтому
+# каталог задается до первого импорта, в том числе в мастер-процессе.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/foodgram-metrics')
+
+
+def on_starting(server):
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
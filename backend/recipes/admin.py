@@ -1,13 +1,18 @@
 from django.contrib import admin
+from django.db import transaction
+from django.db.models import Exists, OuterRef
 
-from recipes.models import (Ingredients, IngredientsRecipe, Recipe, Tag,
-                            TagsRecipe)
+from recipes.admin_utils import AutocompleteFilter, LargeTableAdmin
+from recipes.counters import refresh_counter
+from recipes.models import (Ingredients, IngredientsRecipe, Recipe,
+                            ShoppingListIngredient, Tag, TagsRecipe)
 
 
 class IngredientsInLine(admin.TabularInline):
     model = IngredientsRecipe
     extra = 1
     min_num = 1
+    autocomplete_fields = ('ingredients',)
 
 
 class TagsInLine(admin.TabularInline):
@@ -16,6 +21,24 @@ class TagsInLine(admin.TabularInline):
     min_num = 1
 
 
+class TagFilter(admin.SimpleListFilter):
+    """Фильтр по тегу через EXISTS: рецепты не дублируются."""
+    title = 'Теги'
+    parameter_name = 'tag'
+
+    def lookups(self, request, model_admin):
+        return Tag.objects.values_list('slug', 'name')
+
+    def queryset(self, request, queryset):
+        if self.value() is None:
+            return queryset
+        return queryset.filter(
+            Exists(TagsRecipe.objects.filter(
+                recipe=OuterRef('pk'), tags__slug=self.value()
+            ))
+        )
+
+
 class IngredientsAdmin(admin.ModelAdmin):
     list_display = ('name', 'measurement_unit')
     list_filter = ('name', 'measurement_unit')
@@ -30,18 +53,68 @@ class TagAdmin(admin.ModelAdmin):
     empty_value_display = '-пусто-'
 
 
-class RecipeAdmin(admin.ModelAdmin):
+class RecipeAdmin(LargeTableAdmin):
     list_display = ('name', 'author', 'count_favorites')
-    list_filter = ('name', 'author', 'tags')
-    search_fields = ('name', 'author', 'tags')
-    empty_value_display = '-пусто-'
+    list_select_related = ('author',)
+    list_filter = (('author', AutocompleteFilter), TagFilter)
+    search_fields = ('name', '^author__username')
+    autocomplete_fields = ('author',)
     inlines = [IngredientsInLine, TagsInLine]
     readonly_fields = ('count_favorites',)
 
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Кроме названия и автора ищет рецепты по точному слагу тега.
+        Тег проверяется через EXISTS, поэтому DISTINCT не нужен.
+        """
+        results, use_distinct = super().get_search_results(
+            request, queryset, search_term
+        )
+        if search_term:
+            results |= queryset.filter(
+                Exists(TagsRecipe.objects.filter(
+                    recipe=OuterRef('pk'), tags__slug=search_term.strip()
+                ))
+            )
+        return results, use_distinct
+
+    @transaction.atomic
+    def save_related(self, request, form, formsets, change):
+        if not change:
+            return super().save_related(request, form, formsets, change)
+        ShoppingListIngredient.objects.remove_recipe(form.instance.id)
+        super().save_related(request, form, formsets, change)
+        ShoppingListIngredient.objects.add_recipe(form.instance.id)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        authors = {obj.author_id}
+        if change and 'author' in form.changed_data:
+            authors.add(form.initial['author'])
+        refresh_counter('recipes_count', authors)
+
+    @transaction.atomic
+    def delete_model(self, request, obj):
+        ShoppingListIngredient.objects.remove_recipe(obj.id)
+        super().delete_model(request, obj)
+        refresh_counter('recipes_count', {obj.author_id})
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        recipes = list(queryset.values_list('id', 'author_id'))
+        ShoppingListIngredient.objects.remove_recipes(
+            [recipe_id for recipe_id, _ in recipes]
+        )
+        super().delete_queryset(request, queryset)
+        refresh_counter(
+            'recipes_count', {author_id for _, author_id in recipes}
+        )
+
     def count_favorites(self, obj):
-        return obj.is_favorited.count()
+        return obj.favorites_count
 
     count_favorites.short_description = 'Кол-во добавлений в избранное'
+    count_favorites.admin_order_field = 'favorites_count'
 
 
 admin.site.register(Recipe, RecipeAdmin)
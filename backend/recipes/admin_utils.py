@@ -0,0 +1,80 @@
+"""
+Общие части админки для больших таблиц: фильтр по внешнему ключу с
+автодополнением и пагинатор без точного COUNT(*).
+"""
+from django import forms
+from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.paginator import Paginator
+from django.db import connection
+from django.utils.functional import cached_property
+
+# Таблицы меньше этого размера считаются точно.
+ESTIMATE_MIN_ROWS = 10000
+
+
+class AutocompleteFilter(admin.RelatedFieldListFilter):
+    """
+    Фильтр по связанному объекту с полем автодополнения вместо списка
+    всех объектов. Варианты подгружает autocomplete-представление
+    админки, поэтому у админки связанной модели должны быть search_fields.
+    """
+    template = 'recipes/autocomplete_filter.html'
+
+    def field_choices(self, field, request, model_admin):
+        # Поле формы передает виджету queryset, по которому загружается
+        # только выбранный объект.
+        self.widget = forms.ModelChoiceField(
+            queryset=field.remote_field.model._default_manager.all(),
+            widget=AutocompleteSelect(field, model_admin.admin_site),
+            required=False,
+        ).widget
+        return []
+
+    def has_output(self):
+        return True
+
+    def rendered_widget(self):
+        return self.widget.render(self.lookup_kwarg, self.lookup_val)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Для запросов без условий к большим таблицам PostgreSQL берет число
+    строк из статистики планировщика вместо COUNT(*). Последние страницы
+    при этом могут оказаться пустыми или неполными.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                    (queryset.model._meta.db_table,)
+                )
+                row = cursor.fetchone()
+            if row is not None and row[0] >= ESTIMATE_MIN_ROWS:
+                return int(row[0])
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Админка для больших таблиц: без точного подсчета всех записей и
+    с подключенными скриптами для AutocompleteFilter.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    empty_value_display = '-пусто-'
+
+    @property
+    def media(self):
+        # Набор скриптов виджета не зависит от поля.
+        autocomplete = AutocompleteSelect(
+            self.opts.pk, self.admin_site
+        ).media
+        return super().media + autocomplete + forms.Media(
+            js=('recipes/js/autocomplete_filter.js',)
+        )
@@ -0,0 +1,100 @@
+"""
+Денормализованные счетчики: добавления рецепта в избранное, рецепты и
+подписчики автора. Меняются выражениями F() в одной транзакции со
+связями, при массовых изменениях пересчитываются по связям, а команда
+reconcile_counters находит и исправляет расхождения.
+"""
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from recipes.models import (Favorite, Recipe, ShoppingListIngredient,
+                            Subsription)
+from users.models import FoodgramUser
+
+# Счетчик: (модель, поле счетчика, модель связи, поле связи).
+COUNTERS = {
+    'favorites_count': (Recipe, 'favorites_count', Favorite, 'recipe'),
+    'recipes_count': (FoodgramUser, 'recipes_count', Recipe, 'author'),
+    'subscribers_count': (
+        FoodgramUser, 'subscribers_count', Subsription, 'author'
+    ),
+}
+
+
+def shifted(field, delta):
+    """
+    Выражение: счетчик, измененный на delta, но не меньше нуля.
+    Если счетчик разошелся со связями и уже равен нулю, уменьшение
+    не нарушает ограничение положительного поля; расхождение исправит
+    reconcile_counters.
+    """
+    return Greatest(F(field) + delta, 0)
+
+
+def change_counter(name, pk, delta=1):
+    model, field, _, _ = COUNTERS[name]
+    model.objects.filter(pk=pk).update(**{field: shifted(field, delta)})
+
+
+def change_counters(name, pks, delta=1):
+    """Меняет счетчик объектов pks одним UPDATE."""
+    model, field, _, _ = COUNTERS[name]
+    if pks:
+        model.objects.filter(pk__in=pks).update(
+            **{field: shifted(field, delta)}
+        )
+
+
+def actual_count(name):
+    """Выражение: число связей объекта, посчитанное подзапросом."""
+    _, _, related, related_field = COUNTERS[name]
+    return Coalesce(
+        Subquery(
+            related.objects.filter(
+                **{related_field: OuterRef('pk')}
+            ).order_by().values(related_field).annotate(
+                total=Count('pk')
+            ).values('total')
+        ),
+        0
+    )
+
+
+def stale_objects(name, pks=None):
+    """Объекты, у которых счетчик не совпадает с числом связей."""
+    model, field, _, _ = COUNTERS[name]
+    queryset = model.objects.all() if pks is None else (
+        model.objects.filter(pk__in=pks)
+    )
+    return queryset.exclude(**{field: actual_count(name)})
+
+
+def refresh_counter(name, pks=None):
+    """Пересчитывает счетчик объектов pks (всех, если не заданы)."""
+    _, field, _, _ = COUNTERS[name]
+    return stale_objects(name, pks).update(**{field: actual_count(name)})
+
+
+@transaction.atomic
+def delete_users(queryset):
+    """
+    Удаляет пользователей. Каскадно удаляются их избранное и подписки,
+    поэтому счетчики затронутых рецептов и авторов пересчитываются,
+    а также их рецепты: до удаления они вычитаются из списков покупок
+    тех, у кого лежат в корзине.
+    """
+    ShoppingListIngredient.objects.remove_recipes(list(
+        Recipe.objects.filter(author__in=queryset).values_list(
+            'id', flat=True
+        )
+    ))
+    recipe_ids = set(Favorite.objects.filter(
+        user__in=queryset
+    ).values_list('recipe_id', flat=True))
+    author_ids = set(Subsription.objects.filter(
+        user__in=queryset
+    ).values_list('author_id', flat=True))
+    queryset.delete()
+    refresh_counter('favorites_count', recipe_ids)
+    refresh_counter('subscribers_count', author_ids)
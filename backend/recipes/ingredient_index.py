@@ -0,0 +1,166 @@
+"""
+Индекс ингредиентов для поиска по началу названия.
+
+Индекс хранится в файле, отсортированном по названию в нижнем регистре,
+и отображается в память (mmap), поэтому все воркеры gunicorn используют
+одну копию страниц. Поиск выполняется бинарным поиском без обращения к БД.
+
+Формат файла:
+    заголовок   <4sI>  сигнатура, количество записей
+    смещения    <I>    смещение каждой записи от начала файла
+    записи      <IHHH> id, длины ключа, названия и единиц измерения,
+                       затем сами строки в UTF-8
+"""
+import mmap
+import os
+import struct
+import tempfile
+
+from django.conf import settings
+
+from recipes.models import Ingredients
+
+MAGIC = b'FGI1'
+HEADER = struct.Struct('<4sI')
+OFFSET = struct.Struct('<I')
+RECORD = struct.Struct('<IHHH')
+
+
+def make_key(name):
+    return name.lower()
+
+
+def build_ingredient_index(path=None):
+    """Строит файл индекса из таблицы Ingredients и атомарно заменяет его."""
+    path = path or settings.INGREDIENT_INDEX_PATH
+    rows = sorted(
+        (
+            make_key(name).encode(),
+            ingredient_id,
+            name.encode(),
+            measurement_unit.encode(),
+        )
+        for ingredient_id, name, measurement_unit
+        in Ingredients.objects.values_list(
+            'id', 'name', 'measurement_unit'
+        ).iterator()
+    )
+    offset = HEADER.size + OFFSET.size * len(rows)
+    offsets, records = [], []
+    for key, ingredient_id, name, measurement_unit in rows:
+        record = RECORD.pack(
+            ingredient_id, len(key), len(name), len(measurement_unit)
+        ) + key + name + measurement_unit
+        offsets.append(OFFSET.pack(offset))
+        records.append(record)
+        offset += len(record)
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=directory, delete=False) as file:
+        file.write(HEADER.pack(MAGIC, len(rows)))
+        file.writelines(offsets)
+        file.writelines(records)
+    os.chmod(file.name, 0o644)
+    os.replace(file.name, path)
+    return len(rows)
+
+
+class IngredientIndex:
+    """Отображенный в память индекс, перечитывается при замене файла."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._mmap = None
+        self._version = None
+        self._count = 0
+
+    def _open(self):
+        path = self.path or settings.INGREDIENT_INDEX_PATH
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self._close()
+            return False
+        version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if version == self._version:
+            return True
+        self._close()
+        if stat.st_size < HEADER.size:
+            return False
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(
+                file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        magic, self._count = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self._close()
+            return False
+        self._version = version
+        return True
+
+    def _close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+        self._mmap = None
+        self._version = None
+        self._count = 0
+
+    def _record(self, position):
+        (offset,) = OFFSET.unpack_from(
+            self._mmap, HEADER.size + OFFSET.size * position
+        )
+        ingredient_id, key_len, name_len, unit_len = RECORD.unpack_from(
+            self._mmap, offset
+        )
+        start = offset + RECORD.size
+        return (
+            ingredient_id,
+            self._mmap[start:start + key_len],
+            start + key_len,
+            name_len,
+            unit_len,
+        )
+
+    def _key(self, position):
+        return self._record(position)[1]
+
+    def _lower_bound(self, key):
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def search(self, prefix, limit=None):
+        """
+        Возвращает ингредиенты, название которых начинается с prefix,
+        или None, если индекс еще не построен.
+        """
+        if not self._open():
+            return None
+        key = make_key(prefix).encode()
+        results = []
+        position = self._lower_bound(key)
+        while position < self._count:
+            if limit is not None and len(results) >= limit:
+                break
+            ingredient_id, record_key, start, name_len, unit_len = (
+                self._record(position)
+            )
+            if not record_key.startswith(key):
+                break
+            results.append({
+                'id': ingredient_id,
+                'name': self._mmap[start:start + name_len].decode(),
+                'measurement_unit': self._mmap[
+                    start + name_len:start + name_len + unit_len
+                ].decode(),
+            })
+            position += 1
+        return results
+
+
+ingredient_index = IngredientIndex()
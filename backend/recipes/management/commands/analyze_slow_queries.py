@@ -0,0 +1,92 @@
+import json
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.queries import normalize_sql
+from recipes.management.commands.benchmark import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        'Группирует запросы из лога медленных запросов (SLOW_QUERY_LOG, '
+        'файлы всех процессов и ротированные) по SQL без значений '
+        'параметров и выводит число, суммарное время и p95 для каждой группы.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--log',
+            type=Path,
+            default=Path(settings.SLOW_QUERY_LOG),
+            help='Файл лога медленных запросов.',
+        )
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument(
+            '--view',
+            help='Только запросы представления, например RecipeViewSet.list.',
+        )
+        parser.add_argument(
+            '--plans',
+            action='store_true',
+            help='Показать план самого долгого запроса каждой группы.',
+        )
+
+    def read_entries(self, path):
+        # Файлы процессов (slow_queries.<pid>.log) с ротированными копиями.
+        paths = sorted(path.parent.glob(f'{path.stem}.*'))
+        if not paths:
+            raise CommandError(f'Лог медленных запросов не найден: {path}')
+        for log in paths:
+            with open(log, encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+
+    def handle(self, *args, **options):
+        groups = defaultdict(list)
+        for entry in self.read_entries(options['log']):
+            if options['view'] and entry['view'] != options['view']:
+                continue
+            groups[normalize_sql(entry['sql'])].append(entry)
+        if not groups:
+            self.stdout.write('No slow queries found')
+            return
+        rows = sorted(
+            groups.items(),
+            key=lambda group: sum(
+                entry['duration_ms'] for entry in group[1]
+            ),
+            reverse=True,
+        )
+        self.stdout.write(
+            f'{"count":>7}{"timeouts":>10}{"total ms":>12}{"p95 ms":>10}'
+            f'{"max ms":>10}  views'
+        )
+        for sql, entries in rows[:options['limit']]:
+            durations = [entry['duration_ms'] for entry in entries]
+            views = sorted({entry['view'] for entry in entries})
+            timeouts = sum(entry['timeout'] for entry in entries)
+            self.stdout.write(
+                f'{len(entries):>7}{timeouts:>10}{sum(durations):>12.1f}'
+                f'{percentile(durations, 95):>10.1f}{max(durations):>10.1f}'
+                f'  {", ".join(views)}'
+            )
+            self.stdout.write(f'        {sql}')
+            if options['plans']:
+                slowest = max(
+                    (entry for entry in entries if entry['plan']),
+                    key=lambda entry: entry['duration_ms'],
+                    default=None,
+                )
+                if slowest is not None:
+                    for line in slowest['plan'].splitlines():
+                        self.stdout.write(f'            {line}')
+        self.stdout.write(
+            f'{sum(map(len, groups.values()))} slow queries '
+            f'in {len(groups)} groups'
+        )
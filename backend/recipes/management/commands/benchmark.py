@@ -0,0 +1,367 @@
+import json
+import logging
+import statistics
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, Exists, OuterRef
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.queries import QueryCounter
+from foodgram.settings import BASE_DIR
+from recipes.models import (Favorite, Ingredients, Recipe, ShoppingCart,
+                            Subsription, Tag)
+from users.models import FoodgramUser
+
+# Сценарии: запросы из postman-коллекции по их названиям. Запросы,
+# изменяющие данные, идут парами, чтобы каждая итерация возвращала
+# БД в исходное состояние.
+SCENARIOS = {
+    'recipes': (
+        'get_recipes_list // No Auth',
+        'get_recipes_list // User',
+        'get_recipes_list_with_limit_param // User',
+    ),
+    'recipe_filters': (
+        'get_recipes_list_with_author_param // User',
+        'get_recipes_list_with_two_tags_param // User',
+        'get_recipes_list_with_is_favorited_param // User',
+        'get_recipes_list_with_is_in_shopping_cart_param // User',
+    ),
+    'recipe_detail': (
+        'get_recipe_detail // No Auth',
+    ),
+    'favorite': (
+        'add_to_favorite // User',
+        'remove_from_favorite // User',
+    ),
+    'shopping_cart': (
+        'add_to_shopping_cart // User',
+        'remove_from_shopping_cart // User',
+    ),
+    'download_shopping_cart': (
+        'download_shopping_cart // User',
+    ),
+    'subscribe': (
+        'create_subscription // User',
+        'delete_first_subscription // User',
+    ),
+    'subscriptions': (
+        'get_subscription_list // User',
+        'get_subscription_list_with_recipes_limit_param // User',
+    ),
+    'ingredients': (
+        'get_ingredients_list_with_name_filter // User',
+        'get_ingredients_list // User',
+    ),
+    'tags': (
+        'get_tag_list // User',
+    ),
+    'users': (
+        'get_user_list// User',
+        'get_profile // User',
+        'users_me // User',
+    ),
+}
+COLLECTION = (
+    BASE_DIR.parent / 'postman-collection' / 'diploma.postman_collection.json'
+)
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    position = (len(values) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (
+        position - lower
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Воспроизводит запросы postman-коллекции внутри процесса на '
+        'заполненной БД (см. generate_data) и выводит перцентили '
+        'задержки, пропускную способность и число запросов к БД по '
+        'каждому эндпоинту. Умеет сохранять результат и сравнивать '
+        'его с сохраненным ранее.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'scenarios',
+            nargs='*',
+            help=f'Сценарии: {", ".join(SCENARIOS)}. По умолчанию все.',
+        )
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument(
+            '--collection',
+            type=Path,
+            default=COLLECTION,
+            help='Файл postman-коллекции.',
+        )
+        parser.add_argument(
+            '--user',
+            help=(
+                'Email пользователя, от имени которого выполняются '
+                'запросы. По умолчанию пользователь с самой большой '
+                'корзиной.'
+            ),
+        )
+        parser.add_argument(
+            '--output',
+            type=Path,
+            help='Сохранить результат в JSON-файл.',
+        )
+        parser.add_argument(
+            '--baseline',
+            type=Path,
+            help='Сравнить с результатом, сохраненным через --output.',
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=20,
+            help='Допустимый рост p95 относительно baseline, в процентах.',
+        )
+
+    def load_collection(self, path):
+        try:
+            with open(path, encoding='utf-8') as file:
+                collection = json.load(file)
+        except FileNotFoundError:
+            raise CommandError(f'Postman-коллекция не найдена: {path}')
+        requests = {}
+        items = list(collection['item'])
+        while items:
+            item = items.pop(0)
+            if 'item' in item:
+                items.extend(item['item'])
+            else:
+                requests.setdefault(item['name'], item['request'])
+        variables = {
+            variable['key']: variable['value']
+            for variable in collection.get('variable', ())
+        }
+        return requests, variables
+
+    def get_user(self, email):
+        if email:
+            try:
+                return FoodgramUser.objects.get(email=email)
+            except FoodgramUser.DoesNotExist:
+                raise CommandError(f'Пользователь {email} не найден.')
+        user = FoodgramUser.objects.annotate(
+            cart_size=Count('is_in_shopping_cart')
+        ).order_by('-cart_size', 'id').first()
+        if user is None:
+            raise CommandError('БД пуста, сначала выполните generate_data.')
+        return user
+
+    def get_variables(self, user):
+        """Подставляет в переменные коллекции объекты из БД."""
+        recipe = Recipe.objects.exclude(author=user).exclude(
+            Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            ))
+        ).exclude(
+            Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            ))
+        ).order_by('-created_at', '-id').first()
+        authors = FoodgramUser.objects.exclude(pk=user.pk).exclude(
+            Exists(Subsription.objects.filter(
+                user=user, author=OuterRef('pk')
+            ))
+        ).filter(recipes__isnull=False).distinct().order_by('id')[:2]
+        tags = Tag.objects.order_by('id')[:3]
+        ingredient = Ingredients.objects.order_by('id').first()
+        if recipe is None or len(authors) < 2 or len(tags) < 3:
+            raise CommandError(
+                'Недостаточно данных для сценариев, '
+                'сначала выполните generate_data.'
+            )
+        return {
+            'baseUrl': '',
+            'userId': user.id,
+            'secondUserId': authors[1].id,
+            'thirdUserId': authors[0].id,
+            'firstRecipeId': recipe.id,
+            'firstTagId': tags[0].id,
+            'secondTagSlug': tags[1].slug,
+            'thirdTagSlug': tags[2].slug,
+            'firstIndredientId': ingredient.id,
+            'ingredientNameFirstLatter': ingredient.name[0],
+        }
+
+    def substitute(self, value, variables):
+        for key, replacement in variables.items():
+            value = value.replace(f'{{{{{key}}}}}', str(replacement))
+        return value
+
+    def build_request(self, name, variables):
+        try:
+            request = self.requests[name]
+        except KeyError:
+            raise CommandError(f'В коллекции нет запроса {name}.')
+        url = self.substitute(request['url']['raw'], variables)
+        body = (request.get('body') or {}).get('raw')
+        return {
+            'method': request['method'].lower(),
+            'path': url,
+            'data': self.substitute(body, variables) if body else None,
+            'authenticated': (
+                (request.get('auth') or {}).get('type') == 'apikey'
+            ),
+        }
+
+    def perform(self, request):
+        client = self.user_client if request['authenticated'] else (
+            self.anonymous_client
+        )
+        counter = QueryCounter()
+        started = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            response = getattr(client, request['method'])(
+                request['path'], request['data'],
+                content_type='application/json'
+            )
+            if response.streaming:
+                b''.join(response.streaming_content)
+        duration = time.perf_counter() - started
+        if response.status_code >= 400:
+            raise CommandError(
+                f'{request["method"].upper()} {request["path"]}: '
+                f'{response.status_code} {response.content[:200]!r}'
+            )
+        return duration, counter.count, counter.duration
+
+    def run_scenario(self, names, variables, iterations, warmup):
+        requests = [self.build_request(name, variables) for name in names]
+        samples = {name: [] for name in names}
+        for iteration in range(warmup + iterations):
+            for name, request in zip(names, requests):
+                result = self.perform(request)
+                if iteration >= warmup:
+                    samples[name].append(result)
+        return {
+            name: self.summarize(results)
+            for name, results in samples.items()
+        }
+
+    def summarize(self, results):
+        durations = [duration * 1000 for duration, _, _ in results]
+        queries = [count for _, count, _ in results]
+        return {
+            'p50': percentile(durations, 50),
+            'p95': percentile(durations, 95),
+            'p99': percentile(durations, 99),
+            'mean': statistics.mean(durations),
+            'rps': 1000 / statistics.mean(durations),
+            'queries': max(queries),
+            'queries_min': min(queries),
+            'db_ms': statistics.mean(
+                db_duration * 1000 for _, _, db_duration in results
+            ),
+        }
+
+    def report(self, results, baseline):
+        self.stdout.write(
+            f'{"endpoint":<58}{"p50":>8}{"p95":>8}{"p99":>8}'
+            f'{"rps":>8}{"queries":>9}{"db ms":>8}'
+        )
+        regressions = []
+        for name, result in results.items():
+            queries = str(result['queries'])
+            if result['queries_min'] != result['queries']:
+                queries = f'{result["queries_min"]}-{queries}'
+            line = (
+                f'{name:<58}{result["p50"]:>8.2f}{result["p95"]:>8.2f}'
+                f'{result["p99"]:>8.2f}{result["rps"]:>8.0f}'
+                f'{queries:>9}{result["db_ms"]:>8.2f}'
+            )
+            previous = baseline.get(name)
+            if previous is None:
+                self.stdout.write(line)
+                continue
+            change = (result['p95'] / previous['p95'] - 1) * 100
+            line += (
+                f'  p95 {change:+.0f}%, '
+                f'queries {result["queries"] - previous["queries"]:+d}'
+            )
+            if (
+                result['queries'] > previous['queries']
+                or change > self.threshold
+            ):
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+        return regressions
+
+    def handle(self, *args, **options):
+        unknown = set(options['scenarios']) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(
+                f'Неизвестные сценарии: {", ".join(sorted(unknown))}'
+            )
+        if options['iterations'] < 1:
+            raise CommandError('Нужна хотя бы одна итерация.')
+        self.threshold = options['threshold']
+        baseline = {}
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)['results']
+        self.requests, variables = self.load_collection(
+            options['collection']
+        )
+        user = self.get_user(options['user'])
+        variables.update(self.get_variables(user))
+        token, created = Token.objects.get_or_create(user=user)
+        # Строки лога о каждом запросе только мешают выводу результатов.
+        logging.getLogger('api.timing').setLevel(logging.WARNING)
+        setup_test_environment()
+        try:
+            self.anonymous_client = APIClient()
+            self.user_client = APIClient()
+            self.user_client.credentials(
+                HTTP_AUTHORIZATION=f'Token {token.key}'
+            )
+            results = {}
+            started = time.perf_counter()
+            for scenario, names in SCENARIOS.items():
+                if options['scenarios'] and (
+                    scenario not in options['scenarios']
+                ):
+                    continue
+                results.update(self.run_scenario(
+                    names, variables, options['iterations'],
+                    options['warmup']
+                ))
+            elapsed = time.perf_counter() - started
+        finally:
+            teardown_test_environment()
+            if created:
+                token.delete()
+        regressions = self.report(results, baseline)
+        total = len(results) * (options['iterations'] + options['warmup'])
+        self.stdout.write(
+            f'{total} requests in {elapsed:.2f}s '
+            f'({total / elapsed:.0f} requests/s)'
+        )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(
+                    {'user': user.email, 'results': results},
+                    file, ensure_ascii=False, indent=2
+                )
+        if regressions:
+            raise CommandError(
+                f'Регрессия относительно baseline: {", ".join(regressions)}'
+            )
+        self.stdout.write(self.style.SUCCESS('Benchmark completed'))
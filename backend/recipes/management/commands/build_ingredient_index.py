@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipes.ingredient_index import build_ingredient_index
+
+
+class Command(BaseCommand):
+    help = 'Строит индекс ингредиентов для поиска по названию.'
+
+    def handle(self, *args, **options):
+        count = build_ingredient_index()
+        self.stdout.write(self.style.SUCCESS(
+            f'Ingredient index built: {count} ingredients '
+            f'in {settings.INGREDIENT_INDEX_PATH}'
+        ))
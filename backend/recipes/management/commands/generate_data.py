@@ -0,0 +1,342 @@
+import random
+import time
+from datetime import timedelta
+from itertools import accumulate, islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from recipes.counters import COUNTERS, refresh_counter
+from recipes.models import (Favorite, Ingredients, IngredientsRecipe, Recipe,
+                            ShoppingCart, ShoppingListIngredient, Subsription,
+                            Tag, TagsRecipe)
+from users.models import FoodgramUser
+
+FIRST_NAMES = (
+    'Анна', 'Иван', 'Мария', 'Петр', 'Ольга', 'Сергей', 'Елена', 'Дмитрий',
+    'Наталья', 'Алексей', 'Татьяна', 'Андрей', 'Юлия', 'Михаил', 'Ирина',
+)
+LAST_NAMES = (
+    'Иванова', 'Смирнов', 'Кузнецова', 'Попов', 'Васильева', 'Петров',
+    'Соколова', 'Михайлов', 'Новикова', 'Федоров', 'Морозова', 'Волков',
+)
+DISHES = (
+    'Суп', 'Салат', 'Пирог', 'Рагу', 'Омлет', 'Каша', 'Запеканка', 'Паста',
+    'Плов', 'Оладьи', 'Котлеты', 'Рулет', 'Смузи', 'Жаркое', 'Ризотто',
+)
+DISH_DETAILS = (
+    'по-домашнему', 'с грибами', 'с курицей', 'овощной', 'быстрый',
+    'праздничный', 'с сыром', 'постный', 'бабушкин', 'острый', 'летний',
+)
+COOKING_TIMES = (5, 10, 15, 20, 25, 30, 40, 45, 60, 90, 120, 180)
+# Диапазоны и шаг количества для распространенных единиц измерения.
+UNIT_AMOUNTS = {
+    'г': (10, 1000, 10),
+    'кг': (1, 3, 1),
+    'мл': (10, 1000, 10),
+    'л': (1, 3, 1),
+    'шт.': (1, 12, 1),
+    'ст. л.': (1, 6, 1),
+    'ч. л.': (1, 4, 1),
+}
+DEFAULT_AMOUNT = (1, 10, 1)
+# Параметр распределения Парето для числа подписок, избранного и т.п.:
+# у большинства пользователей их немного, у единиц — сотни.
+DEGREE_SHAPE = 2.0
+IMAGE = 'recipes/generated.png'
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def zipf_weights(count, alpha):
+    """Накопленные веса, убывающие по степенному закону от ранга."""
+    return list(accumulate(1 / rank ** alpha for rank in range(1, count + 1)))
+
+
+class Command(BaseCommand):
+    help = (
+        'Генерирует воспроизводимый набор данных для нагрузочного '
+        'тестирования: пользователей, рецепты, избранное, корзины и '
+        'подписки со степенным распределением популярности. '
+        'Использует справочники ингредиентов и тегов из БД. '
+        'Работает только с PostgreSQL.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument(
+            '--subscriptions',
+            type=float,
+            default=10,
+            help='Среднее число подписок на пользователя.',
+        )
+        parser.add_argument(
+            '--favorites',
+            type=float,
+            default=20,
+            help='Среднее число рецептов в избранном у пользователя.',
+        )
+        parser.add_argument(
+            '--carts',
+            type=float,
+            default=0.3,
+            help='Доля пользователей с непустой корзиной.',
+        )
+        parser.add_argument(
+            '--alpha',
+            type=float,
+            default=1.1,
+            help='Показатель степенного распределения популярности.',
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=365,
+            help='За сколько дней распределить даты публикации рецептов.',
+        )
+        parser.add_argument(
+            '--password',
+            help=(
+                'Общий пароль сгенерированных пользователей. '
+                'По умолчанию войти под ними нельзя.'
+            ),
+        )
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def insert(self, model, objects):
+        """Вставляет объекты пакетами и возвращает id созданных строк."""
+        started = time.monotonic()
+        ids = []
+        for batch in batches(objects, self.batch_size):
+            ids.extend(obj.id for obj in model.objects.bulk_create(batch))
+            if self.verbosity > 1:
+                self.stdout.write(f'  {model._meta.model_name}: {len(ids)}')
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'{model._meta.model_name}: {len(ids)} rows in {elapsed:.2f}s '
+            f'({len(ids) / elapsed if elapsed else len(ids):.0f} rows/s)'
+        )
+        return ids
+
+    def degree(self, mean, limit):
+        """Случайная степень вершины с тяжелым хвостом и заданным средним."""
+        scale = mean * (DEGREE_SHAPE - 1) / DEGREE_SHAPE
+        return min(int(scale * self.rng.paretovariate(DEGREE_SHAPE)), limit)
+
+    def sample(self, population, cum_weights, count, exclude=None):
+        """Выбирает count разных элементов с учетом весов."""
+        chosen = set()
+        attempts = 0
+        while len(chosen) < count and attempts < 10:
+            chosen.update(self.rng.choices(
+                population, cum_weights=cum_weights, k=count - len(chosen)
+            ))
+            chosen.discard(exclude)
+            attempts += 1
+        return list(chosen)[:count]
+
+    def ranked(self, ids):
+        """Случайно ранжирует id и возвращает их с весами популярности."""
+        ids = list(ids)
+        self.rng.shuffle(ids)
+        return ids, zipf_weights(len(ids), self.alpha)
+
+    def generate_users(self, count, password):
+        prefix = f'gen{self.seed}_'
+        if FoodgramUser.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(
+                f'Данные с --seed {self.seed} уже сгенерированы, '
+                f'укажите другой --seed.'
+            )
+        hashed = make_password(password) if password else None
+        return self.insert(FoodgramUser, (
+            FoodgramUser(
+                username=f'{prefix}{i}',
+                email=f'{prefix}{i}@example.com',
+                first_name=self.rng.choice(FIRST_NAMES),
+                last_name=self.rng.choice(LAST_NAMES),
+                password=hashed or make_password(None),
+            ) for i in range(count)
+        ))
+
+    def make_recipe(self, authors, author_weights):
+        return Recipe(
+            name=(
+                f'{self.rng.choice(DISHES)} '
+                f'{self.rng.choice(DISH_DETAILS)}'
+            ),
+            text='Сгенерированный рецепт для нагрузочного тестирования.',
+            cooking_time=self.rng.choice(COOKING_TIMES),
+            image=IMAGE,
+            author_id=self.rng.choices(authors, cum_weights=author_weights)[0],
+        )
+
+    def set_created_at(self, recipe_ids):
+        """Распределяет даты публикации: auto_now_add не дает задать их."""
+        now = timezone.now()
+        created_at = [
+            now - timedelta(seconds=self.rng.uniform(0, self.days * 86400))
+            for _ in recipe_ids
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {Recipe._meta.db_table} recipe '
+                f'SET created_at = generated.created_at '
+                f'FROM unnest(%s::integer[], %s::timestamptz[]) '
+                f'AS generated (id, created_at) '
+                f'WHERE recipe.id = generated.id',
+                (recipe_ids, created_at)
+            )
+
+    def make_amount(self, measurement_unit):
+        low, high, step = UNIT_AMOUNTS.get(measurement_unit, DEFAULT_AMOUNT)
+        return self.rng.randrange(low, high + 1, step)
+
+    def generate_recipe_relations(self, recipe_ids):
+        ingredient_rows, tag_rows = [], []
+        for recipe_id in recipe_ids:
+            count = round(self.rng.triangular(2, 15, 7))
+            for ingredient_id in self.sample(
+                self.ingredients, self.ingredient_weights, count
+            ):
+                ingredient_rows.append(IngredientsRecipe(
+                    recipe_id=recipe_id,
+                    ingredients_id=ingredient_id,
+                    amount=self.make_amount(self.units[ingredient_id]),
+                ))
+            for tag_id in self.sample(
+                self.tags, self.tag_weights,
+                self.rng.randint(1, min(3, len(self.tags)))
+            ):
+                tag_rows.append(
+                    TagsRecipe(recipe_id=recipe_id, tags_id=tag_id)
+                )
+        return ingredient_rows, tag_rows
+
+    def generate_recipes(self, count, authors, author_weights):
+        """Рецепты вставляются пакетами вместе с ингредиентами и тегами."""
+        started = time.monotonic()
+        recipe_ids = []
+        relations = {IngredientsRecipe: 0, TagsRecipe: 0}
+        for batch in batches(
+            (
+                self.make_recipe(authors, author_weights)
+                for _ in range(count)
+            ),
+            self.batch_size
+        ):
+            ids = [recipe.id for recipe in Recipe.objects.bulk_create(batch)]
+            self.set_created_at(ids)
+            ingredient_rows, tag_rows = self.generate_recipe_relations(ids)
+            for model, rows in (
+                (IngredientsRecipe, ingredient_rows),
+                (TagsRecipe, tag_rows),
+            ):
+                model.objects.bulk_create(rows, batch_size=self.batch_size)
+                relations[model] += len(rows)
+            recipe_ids.extend(ids)
+            if self.verbosity > 1:
+                self.stdout.write(f'  recipe: {len(recipe_ids)}')
+        elapsed = time.monotonic() - started
+        rows = len(recipe_ids) + sum(relations.values())
+        self.stdout.write(
+            f'recipe: {len(recipe_ids)} rows with '
+            f'{relations[IngredientsRecipe]} ingredients and '
+            f'{relations[TagsRecipe]} tags in {elapsed:.2f}s '
+            f'({rows / elapsed if elapsed else rows:.0f} rows/s)'
+        )
+        return recipe_ids
+
+    def generate_subscriptions(self, users, authors, author_weights, mean):
+        for user_id in users:
+            for author_id in self.sample(
+                authors, author_weights,
+                self.degree(mean, len(authors) - 1), exclude=user_id
+            ):
+                yield Subsription(user_id=user_id, author_id=author_id)
+
+    def generate_favorites(self, users, recipes, recipe_weights, mean):
+        for user_id in users:
+            for recipe_id in self.sample(
+                recipes, recipe_weights, self.degree(mean, len(recipes))
+            ):
+                yield Favorite(user_id=user_id, recipe_id=recipe_id)
+
+    def generate_carts(self, users, recipes, recipe_weights, share):
+        for user_id in users:
+            if self.rng.random() >= share:
+                continue
+            for recipe_id in self.sample(
+                recipes, recipe_weights,
+                min(self.rng.randint(1, 10), len(recipes))
+            ):
+                yield ShoppingCart(user_id=user_id, recipe_id=recipe_id)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError(
+                'Генерация данных работает только с PostgreSQL.'
+            )
+        self.verbosity = options['verbosity']
+        self.batch_size = options['batch_size']
+        self.seed = options['seed']
+        self.alpha = options['alpha']
+        self.days = options['days']
+        self.rng = random.Random(self.seed)
+        self.units = dict(
+            Ingredients.objects.order_by('id').values_list(
+                'id', 'measurement_unit'
+            )
+        )
+        tag_ids = Tag.objects.order_by('id').values_list('id', flat=True)
+        if not self.units or not tag_ids:
+            raise CommandError(
+                'Справочники пусты, сначала выполните '
+                'load_data ingredients tags.'
+            )
+        if options['users'] < 2 or options['recipes'] < 1:
+            raise CommandError('Нужно хотя бы 2 пользователя и 1 рецепт.')
+        self.ingredients, self.ingredient_weights = self.ranked(self.units)
+        self.tags, self.tag_weights = self.ranked(tag_ids)
+        started = time.monotonic()
+        with transaction.atomic():
+            users = self.generate_users(options['users'], options['password'])
+            authors, author_weights = self.ranked(users)
+            recipes = self.generate_recipes(
+                options['recipes'], authors, author_weights
+            )
+            recipes, recipe_weights = self.ranked(recipes)
+            self.insert(Subsription, self.generate_subscriptions(
+                users, authors, author_weights, options['subscriptions']
+            ))
+            self.insert(Favorite, self.generate_favorites(
+                users, recipes, recipe_weights, options['favorites']
+            ))
+            self.insert(ShoppingCart, self.generate_carts(
+                users, recipes, recipe_weights, options['carts']
+            ))
+            ShoppingListIngredient.objects.rebuild()
+            for counter in COUNTERS:
+                refresh_counter(counter)
+            with connection.cursor() as cursor:
+                for model in (
+                    FoodgramUser, Recipe, IngredientsRecipe, TagsRecipe,
+                    Subsription, Favorite, ShoppingCart,
+                    ShoppingListIngredient,
+                ):
+                    cursor.execute(f'ANALYZE {model._meta.db_table}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Data generated successfully in '
+            f'{time.monotonic() - started:.2f}s'
+        ))
@@ -0,0 +1,310 @@
+import csv
+import io
+import json
+import time
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api.catalog import build_catalog
+from foodgram.settings import BASE_DIR
+from recipes.counters import refresh_counter
+from recipes.ingredient_index import build_ingredient_index
+from recipes.models import (Ingredients, IngredientsRecipe, Recipe,
+                            ShoppingListIngredient, Tag, TagsRecipe)
+
+# Наборы данных в порядке загрузки: (модель, файл, поля без id).
+DATASETS = {
+    'ingredients': (
+        Ingredients, 'ingredients.csv', ('name', 'measurement_unit')
+    ),
+    'tags': (Tag, 'tags.csv', ('name', 'color', 'slug')),
+    'recipes': (
+        Recipe,
+        'recipes.csv',
+        ('name', 'cooking_time', 'text', 'image', 'created_at', 'author_id'),
+    ),
+    'ingredients_recipes': (
+        IngredientsRecipe,
+        'ingredients_recipes.csv',
+        ('amount', 'ingredients_id', 'recipe_id'),
+    ),
+    'tags_recipes': (
+        TagsRecipe, 'tags_recipes.csv', ('recipe_id', 'tags_id')
+    ),
+}
+# Наборы, строки которых сопоставляются с БД по естественному ключу:
+# id назначает БД, а ссылки на них в других файлах (номера строк)
+# переводятся в эти id.
+NATURAL_KEYS = {'ingredients': ('name', 'measurement_unit')}
+DATE_FORMATS = ('%d/%m/%Y', '%Y-%m-%d')
+
+
+def iter_json_array(file, chunk_size=64 * 1024):
+    """Потоково читает JSON-массив объектов, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = file.read(chunk_size).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError(f'{file.name}: ожидается JSON-массив.')
+    buffer = buffer[1:]
+    while True:
+        buffer = buffer.lstrip().lstrip(',').lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                raise CommandError(f'{file.name}: некорректный JSON.')
+            buffer += chunk
+            continue
+        yield item
+        buffer = buffer[end:]
+
+
+def parse_created_at(value):
+    created_at = parse_datetime(value)
+    if created_at is None:
+        for date_format in DATE_FORMATS:
+            try:
+                created_at = datetime.strptime(value, date_format)
+                break
+            except ValueError:
+                continue
+        else:
+            raise CommandError(f'Некорректная дата: {value}')
+    if settings.USE_TZ and timezone.is_naive(created_at):
+        created_at = timezone.make_aware(created_at, timezone.utc)
+    return created_at
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает справочники и рецепты из data/ пакетами в одной '
+        'транзакции. Повторный запуск обновляет уже загруженные записи.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'datasets',
+            nargs='*',
+            help=(
+                f'Наборы данных для загрузки: {", ".join(DATASETS)}. '
+                f'По умолчанию все.'
+            ),
+        )
+        parser.add_argument(
+            '--data-dir',
+            type=Path,
+            default=BASE_DIR / 'data',
+            help='Каталог с файлами данных.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Количество строк в одном пакете.',
+        )
+        parser.add_argument(
+            '--ingredients-json',
+            action='store_true',
+            help='Загружать ингредиенты из ingredients.json.',
+        )
+
+    def read_rows(self, name, filename):
+        path = self.data_dir / filename
+        if name == 'ingredients' and self.ingredients_json:
+            path = self.data_dir / 'ingredients.json'
+        with open(path, encoding='utf-8') as file:
+            if path.suffix == '.json':
+                yield from iter_json_array(file)
+            else:
+                yield from csv.DictReader(file)
+
+    def get_ingredient_ids(self):
+        """Номер строки файла ингредиентов -> id ингредиента в БД."""
+        if self.ingredient_ids is None:
+            ids = {
+                (name, measurement_unit): pk
+                for name, measurement_unit, pk in
+                Ingredients.objects.values_list(
+                    'name', 'measurement_unit', 'id'
+                )
+            }
+            self.ingredient_ids = {
+                row_id: ids.get((row['name'], row['measurement_unit']))
+                for row_id, row in enumerate(
+                    self.read_rows('ingredients', 'ingredients.csv'), 1
+                )
+            }
+        return self.ingredient_ids
+
+    def convert(self, name, row_id, row, fields):
+        values = {} if name in NATURAL_KEYS else {'id': row_id}
+        for field in fields:
+            values[field] = row[field]
+        if name == 'ingredients_recipes':
+            ingredient_id = self.get_ingredient_ids().get(
+                int(row['ingredients_id'])
+            )
+            if ingredient_id is None:
+                raise CommandError(
+                    f'Ингредиент {row["ingredients_id"]} не найден: '
+                    f'загрузите ingredients.'
+                )
+            values['ingredients_id'] = ingredient_id
+        if name == 'recipes':
+            values['created_at'] = parse_created_at(row['created_at'])
+            if values['image'] == 'null':
+                values['image'] = ''
+        return values
+
+    def write_postgresql(self, model, fields, rows, key=('id',)):
+        """
+        COPY во временную таблицу и один INSERT ... ON CONFLICT по key.
+        Поля, которых нет в файле (например, счетчики), получают
+        значения по умолчанию модели: в БД у них нет DEFAULT.
+        """
+        table = model._meta.db_table
+        temp_table = f'load_{table}'
+        if key == ('id',):
+            fields = ('id', *fields)
+        columns = tuple(model._meta.get_field(f).column for f in fields)
+        column_list = ', '.join(columns)
+        defaults = [
+            field for field in model._meta.concrete_fields
+            if field.column not in columns and field.has_default()
+        ]
+        insert_list = ', '.join(
+            (*columns, *(field.column for field in defaults))
+        )
+        select_list = ', '.join((*columns, *['%s'] * len(defaults)))
+        key_columns = [model._meta.get_field(f).column for f in key]
+        updates = ', '.join(
+            f'{column} = EXCLUDED.{column}' for column in columns
+            if column not in key_columns
+        )
+        conflict = f'DO UPDATE SET {updates}' if updates else 'DO NOTHING'
+        count = 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE {temp_table} ON COMMIT DROP AS '
+                f'SELECT {column_list} FROM {table} WITH NO DATA'
+            )
+            for batch in batches(rows, self.batch_size):
+                buffer = io.StringIO()
+                writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+                writer.writerows(
+                    [values[field] for field in fields] for values in batch
+                )
+                buffer.seek(0)
+                cursor.cursor.copy_expert(
+                    f'COPY {temp_table} ({column_list}) '
+                    f'FROM STDIN WITH (FORMAT csv)',
+                    buffer
+                )
+                count += len(batch)
+                self.report_batch(model, count)
+            cursor.execute(
+                f'INSERT INTO {table} ({insert_list}) '
+                f'SELECT {select_list} FROM {temp_table} '
+                f'ON CONFLICT ({", ".join(key_columns)}) {conflict}',
+                [
+                    field.get_db_prep_save(field.get_default(), connection)
+                    for field in defaults
+                ]
+            )
+        return count
+
+    def write_bulk(self, model, fields, rows):
+        """bulk_create для остальных СУБД: существующие строки пропускаются."""
+        count = 0
+        for batch in batches(rows, self.batch_size):
+            model.objects.bulk_create(
+                (model(**values) for values in batch),
+                ignore_conflicts=True
+            )
+            count += len(batch)
+            self.report_batch(model, count)
+        return count
+
+    def report_batch(self, model, count):
+        if self.verbosity > 1:
+            self.stdout.write(f'  {model._meta.model_name}: {count}')
+
+    def load(self, name):
+        model, filename, fields = DATASETS[name]
+        rows = (
+            self.convert(name, row_id, row, fields)
+            for row_id, row in enumerate(self.read_rows(name, filename), 1)
+        )
+        started = time.monotonic()
+        if connection.vendor == 'postgresql':
+            count = self.write_postgresql(
+                model, fields, rows, NATURAL_KEYS.get(name, ('id',))
+            )
+        else:
+            count = self.write_bulk(model, fields, rows)
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'{name}: {count} rows in {elapsed:.2f}s '
+            f'({count / elapsed if elapsed else count:.0f} rows/s)'
+        )
+        return model
+
+    def rebuild_derived_data(self, datasets):
+        if 'ingredients' in datasets:
+            build_catalog('ingredients')
+            build_ingredient_index()
+        if 'tags' in datasets:
+            build_catalog('tags')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        self.batch_size = options['batch_size']
+        self.ingredients_json = options['ingredients_json']
+        self.data_dir = options['data_dir']
+        self.ingredient_ids = None
+        unknown = set(options['datasets']) - set(DATASETS)
+        if unknown:
+            raise CommandError(
+                f'Неизвестные наборы данных: {", ".join(sorted(unknown))}'
+            )
+        datasets = [
+            name for name in DATASETS
+            if not options['datasets'] or name in options['datasets']
+        ]
+        started = time.monotonic()
+        with transaction.atomic():
+            models = [self.load(name) for name in datasets]
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(
+                    no_style(), models
+                ):
+                    cursor.execute(sql)
+            if 'ingredients_recipes' in datasets:
+                ShoppingListIngredient.objects.rebuild()
+            if 'recipes' in datasets:
+                refresh_counter('recipes_count')
+        transaction.on_commit(lambda: self.rebuild_derived_data(datasets))
+        self.stdout.write(self.style.SUCCESS(
+            f'Data imported successfully in '
+            f'{time.monotonic() - started:.2f}s'
+        ))
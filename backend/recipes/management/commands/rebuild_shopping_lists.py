@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import ShoppingListIngredient
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает или проверяет списки покупок пользователей.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Только проверить списки покупок, не изменяя их.',
+        )
+
+    def verify(self):
+        expected = ShoppingListIngredient.objects.expected()
+        stored = {
+            (user_id, ingredients_id): amount
+            for user_id, ingredients_id, amount
+            in ShoppingListIngredient.objects.values_list(
+                'user_id', 'ingredients_id', 'amount'
+            ).iterator()
+        }
+        mismatches = 0
+        for key in sorted(expected.keys() | stored.keys()):
+            if expected.get(key) != stored.get(key):
+                mismatches += 1
+                user_id, ingredients_id = key
+                self.stdout.write(
+                    f'user={user_id} ingredient={ingredients_id}: '
+                    f'ожидается {expected.get(key)}, '
+                    f'сохранено {stored.get(key)}'
+                )
+        return mismatches
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            mismatches = self.verify()
+            if mismatches:
+                raise CommandError(
+                    f'Найдено расхождений в списках покупок: {mismatches}'
+                )
+            self.stdout.write(self.style.SUCCESS('Shopping lists are valid'))
+            return
+        with transaction.atomic():
+            ShoppingListIngredient.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS('Shopping lists rebuilt'))
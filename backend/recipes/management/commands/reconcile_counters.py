@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.counters import COUNTERS, refresh_counter, stale_objects
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет денормализованные счетчики (избранное рецептов, рецепты '
+        'и подписчики авторов) с фактическим числом связей и исправляет '
+        'расхождения.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'counters',
+            nargs='*',
+            help=f'Счетчики: {", ".join(COUNTERS)}. По умолчанию все.',
+        )
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Только проверить счетчики, не изменяя их.',
+        )
+
+    def handle(self, *args, **options):
+        unknown = set(options['counters']) - set(COUNTERS)
+        if unknown:
+            raise CommandError(
+                f'Неизвестные счетчики: {", ".join(sorted(unknown))}'
+            )
+        names = options['counters'] or list(COUNTERS)
+        if options['verify']:
+            mismatches = 0
+            for name in names:
+                count = stale_objects(name).count()
+                mismatches += count
+                self.stdout.write(f'{name}: {count} mismatches')
+            if mismatches:
+                raise CommandError(
+                    f'Найдено расхождений в счетчиках: {mismatches}'
+                )
+            self.stdout.write(self.style.SUCCESS('Counters are valid'))
+            return
+        with transaction.atomic():
+            for name in names:
+                self.stdout.write(
+                    f'{name}: {refresh_counter(name)} rows updated'
+                )
+        self.stdout.write(self.style.SUCCESS('Counters reconciled'))
@@ -0,0 +1,65 @@
+# Generated by Django 3.2.23 on 2026-10-18 02:59
+
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Sum
+
+
+def fill_shopping_lists(apps, schema_editor):
+    IngredientsRecipe = apps.get_model('recipes', 'IngredientsRecipe')
+    ShoppingListIngredient = apps.get_model(
+        'recipes', 'ShoppingListIngredient'
+    )
+    totals = IngredientsRecipe.objects.filter(
+        recipe__is_in_shopping_cart__isnull=False
+    ).values(
+        'recipe__is_in_shopping_cart__user', 'ingredients'
+    ).annotate(total=Sum('amount')).order_by()
+    ShoppingListIngredient.objects.bulk_create((
+        ShoppingListIngredient(
+            user_id=item['recipe__is_in_shopping_cart__user'],
+            ingredients_id=item['ingredients'],
+            amount=item['total'],
+        ) for item in totals.iterator()
+    ), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0005_auto_20240203_2308'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ingredientsrecipe',
+            name='amount',
+            field=models.PositiveSmallIntegerField(validators=[django.core.validators.MinValueValidator(1, message='Количество должно быть больше 1.'), django.core.validators.MaxValueValidator(32000, message='Количество должно быть меньше 32000.')]),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='cooking_time',
+            field=models.PositiveSmallIntegerField(validators=[django.core.validators.MinValueValidator(1, message='Время приготовления должно быть больше 1.'), django.core.validators.MaxValueValidator(32000, message='Время приготовления должно быть меньше 32000.')], verbose_name='Время приготовления'),
+        ),
+        migrations.CreateModel(
+            name='ShoppingListIngredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.PositiveIntegerField(verbose_name='Количество')),
+                ('ingredients', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list', to='recipes.ingredients')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Ингредиент в списке покупок',
+                'verbose_name_plural': 'Ингредиенты в списках покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppinglistingredient',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredients'), name='unique_shopping_list_ingredient'),
+        ),
+        migrations.RunPython(fill_shopping_lists, migrations.RunPython.noop),
+    ]
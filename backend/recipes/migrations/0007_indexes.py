@@ -0,0 +1,33 @@
+# Generated by Django 3.2.23 on 2026-10-18 03:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_shoppinglistingredient'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ingredientsrecipe',
+            index=models.Index(fields=['recipe', 'ingredients'], include=('amount',), name='ingredients_recipe_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-created_at', '-id'], name='recipe_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-created_at'], name='recipe_author_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tagsrecipe',
+            index=models.Index(fields=['recipe', 'tags'], name='tags_recipe_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tagsrecipe',
+            index=models.Index(fields=['tags', 'recipe'], name='recipe_tags_idx'),
+        ),
+    ]
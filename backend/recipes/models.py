@@ -1,6 +1,7 @@
 from colorfield.fields import ColorField
+from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import connection, models
 
 from foodgram.constants import MAX_LENGTH_MODELS_FIELDS, MAX_VALUE, MIN_VALUE
 from users.models import FoodgramUser
@@ -110,11 +111,30 @@ class Recipe(models.Model):
         verbose_name='Теги',
         related_name='recipes'
     )
+    favorites_count = models.PositiveIntegerField(
+        'Добавлений в избранное',
+        default=0,
+        editable=False,
+    )
 
     class Meta:
         ordering = ('-created_at',)
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(
+                fields=('-created_at', '-id'),
+                name='recipe_created_at_idx'
+            ),
+            models.Index(
+                fields=('author', '-created_at'),
+                name='recipe_author_created_at_idx'
+            ),
+            models.Index(
+                fields=('-favorites_count', '-id'),
+                name='recipe_popular_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -147,6 +167,13 @@ class IngredientsRecipe(models.Model):
     class Meta:
         verbose_name = 'Ингредиент в рецепте'
         verbose_name_plural = 'Ингредиенты в рецептах'
+        indexes = [
+            models.Index(
+                fields=('recipe', 'ingredients'),
+                include=('amount',),
+                name='ingredients_recipe_idx'
+            ),
+        ]
 
     def __str__(self):
         return f'{self.recipe} - {self.ingredients}'
@@ -164,10 +191,104 @@ class TagsRecipe(models.Model):
         related_name='tags_recipe'
     )
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=('recipe', 'tags'),
+                name='tags_recipe_idx'
+            ),
+            models.Index(
+                fields=('tags', 'recipe'),
+                name='recipe_tags_idx'
+            ),
+        ]
+
     def __str__(self):
         return f'{self.tags} - {self.recipe}'
 
 
+class UserRelationManager(models.Manager):
+    """
+    Связи пользователя с рецептом или автором (избранное, корзина,
+    подписки). add и remove выполняются одним запросом и опираются на
+    уникальное ограничение, а не на предварительную проверку, поэтому
+    одновременные запросы не приводят к IntegrityError.
+    """
+
+    def __init__(self, target_field):
+        super().__init__()
+        self.target_field = target_field
+
+    def add(self, user_id, target_id):
+        """
+        Создает связь через INSERT ... ON CONFLICT DO NOTHING.
+        Возвращает False, если связь уже есть или объекта нет.
+        """
+        target_pk = self.model._meta.get_field(self.target_field).target_field
+        try:
+            target_id = target_pk.to_python(target_id)
+        except ValidationError:
+            return False
+        return bool(self.add_many(user_id, [target_id]))
+
+    def add_many(self, user_id, target_ids):
+        """
+        Создает связи с объектами target_ids одним INSERT ... ON CONFLICT
+        DO NOTHING и возвращает id объектов, связь с которыми создана.
+        Уже связанные и несуществующие объекты пропускаются, подписаться
+        на себя нельзя: такая строка не вставляется.
+        """
+        if not target_ids:
+            return set()
+        target = self.model._meta.get_field(self.target_field)
+        target_table = target.related_model._meta.db_table
+        target_pk = target.target_field.column
+        placeholders = ', '.join(['%s'] * len(target_ids))
+        conditions = [f'{target_pk} IN ({placeholders})']
+        params = [user_id, *target_ids]
+        if target.related_model is self.model._meta.get_field(
+            'user'
+        ).related_model:
+            conditions.append(f'{target_pk} <> %s')
+            params.append(user_id)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {self.model._meta.db_table} '
+                f'(user_id, {target.column}) '
+                f'SELECT %s, {target_pk} FROM {target_table} '
+                f'WHERE {" AND ".join(conditions)} '
+                f'ON CONFLICT (user_id, {target.column}) DO NOTHING '
+                f'RETURNING {target.column}',
+                params
+            )
+            return {target_id for target_id, in cursor.fetchall()}
+
+    def remove(self, user_id, target_id):
+        """Удаляет связь одним DELETE, возвращает True, если она была."""
+        deleted, _ = self.filter(
+            user_id=user_id, **{self.target_field: target_id}
+        ).delete()
+        return bool(deleted)
+
+    def remove_many(self, user_id, target_ids):
+        """
+        Удаляет связи с объектами target_ids одним DELETE и возвращает
+        id объектов, связь с которыми была.
+        """
+        if not target_ids:
+            return set()
+        column = self.model._meta.get_field(self.target_field).column
+        placeholders = ', '.join(['%s'] * len(target_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {self.model._meta.db_table} '
+                f'WHERE user_id = %s AND {column} IN ({placeholders}) '
+                f'RETURNING {column}',
+                (user_id, *target_ids)
+            )
+            return {target_id for target_id, in cursor.fetchall()}
+
+
 class Favorite(models.Model):
     user = models.ForeignKey(
         FoodgramUser,
@@ -180,6 +301,8 @@ class Favorite(models.Model):
         related_name='is_favorited',
     )
 
+    objects = UserRelationManager('recipe')
+
     class Meta:
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
@@ -206,6 +329,8 @@ class ShoppingCart(models.Model):
         related_name='is_in_shopping_cart',
     )
 
+    objects = UserRelationManager('recipe')
+
     class Meta:
         verbose_name = 'Список покупок'
         verbose_name_plural = 'Список покупок'
@@ -234,6 +359,8 @@ class Subsription(models.Model):
         verbose_name='Автор рецепта',
     )
 
+    objects = UserRelationManager('author')
+
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
@@ -246,3 +373,171 @@ class Subsription(models.Model):
 
     def __str__(self):
         return f'{self.user} - {self.author}'
+
+
+class ShoppingListIngredientManager(models.Manager):
+    """
+    Поддерживает суммарный список покупок пользователей.
+    Вклад рецепта добавляется после добавления рецепта в корзину и
+    вычитается после удаления строки корзины (remove_cart_recipes),
+    а при изменении или удалении самого рецепта - до него
+    (remove_recipes).
+    Перед чтением состава рецепты блокируются (lock_recipes) до конца
+    транзакции: изменение корзины и изменение ингредиентов рецепта
+    выполняются по очереди, и каждое видит результат другого.
+    """
+
+    def lock_recipes(self, recipe_ids):
+        """Блокирует строки рецептов в порядке id до конца транзакции."""
+        list(Recipe.objects.select_for_update().filter(
+            pk__in=recipe_ids
+        ).order_by('pk').values_list('pk', flat=True))
+
+    def _cart_ingredients(self, recipe_ids=None, user_id=None):
+        conditions, params = [], []
+        if recipe_ids is not None:
+            placeholders = ', '.join(['%s'] * len(recipe_ids))
+            conditions.append(f'cart.recipe_id IN ({placeholders})')
+            params.extend(recipe_ids)
+        if user_id is not None:
+            conditions.append('cart.user_id = %s')
+            params.append(user_id)
+        where = f'WHERE {" AND ".join(conditions)} ' if conditions else ''
+        sql = (
+            f'SELECT cart.user_id, recipe_ingredients.ingredients_id, '
+            f'SUM(recipe_ingredients.amount) AS amount '
+            f'FROM {ShoppingCart._meta.db_table} cart '
+            f'JOIN {IngredientsRecipe._meta.db_table} recipe_ingredients '
+            f'ON recipe_ingredients.recipe_id = cart.recipe_id '
+            f'{where}'
+            f'GROUP BY cart.user_id, recipe_ingredients.ingredients_id'
+        )
+        return sql, params
+
+    def add_recipe(self, recipe_id, user_id=None):
+        """Добавляет ингредиенты рецепта в списки покупок."""
+        self.add_recipes([recipe_id], user_id)
+
+    def add_recipes(self, recipe_ids, user_id=None):
+        """Добавляет ингредиенты рецептов в списки покупок."""
+        if not recipe_ids:
+            return
+        self.lock_recipes(recipe_ids)
+        table = self.model._meta.db_table
+        sql, params = self._cart_ingredients(recipe_ids, user_id)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (user_id, ingredients_id, amount) '
+                f'{sql} '
+                f'ON CONFLICT (user_id, ingredients_id) DO UPDATE '
+                f'SET amount = {table}.amount + EXCLUDED.amount',
+                params
+            )
+
+    def remove_recipe(self, recipe_id, user_id=None):
+        """Вычитает ингредиенты рецепта из списков покупок."""
+        self.remove_recipes([recipe_id], user_id)
+
+    def remove_recipes(self, recipe_ids, user_id=None):
+        """
+        Вычитает ингредиенты рецептов из списков покупок всех, у кого
+        они в корзине. Вызывается до изменения или удаления рецептов.
+        """
+        if not recipe_ids:
+            return
+        self.lock_recipes(recipe_ids)
+        sql, params = self._cart_ingredients(recipe_ids, user_id)
+        self._subtract(sql, params, recipe_ids)
+
+    def remove_cart_recipes(self, recipe_ids, user_id):
+        """
+        Вычитает ингредиенты рецептов, уже удаленных из корзины
+        пользователя. Строки корзины удаляются заранее, и вычитаются
+        только действительно удаленные: параллельный запрос на то же
+        удаление не вычтет их второй раз.
+        """
+        if not recipe_ids:
+            return
+        self.lock_recipes(recipe_ids)
+        placeholders = ', '.join(['%s'] * len(recipe_ids))
+        sql = (
+            f'SELECT %s AS user_id, ingredients_id, '
+            f'SUM(amount) AS amount '
+            f'FROM {IngredientsRecipe._meta.db_table} '
+            f'WHERE recipe_id IN ({placeholders}) '
+            f'GROUP BY ingredients_id'
+        )
+        self._subtract(sql, (user_id, *recipe_ids), recipe_ids, user_id)
+
+    def _subtract(self, sql, params, recipe_ids, user_id=None):
+        # Если список разошелся с корзинами и в нем меньше, чем нужно
+        # вычесть, количество становится нулем, а не отрицательным:
+        # строка удаляется, ограничение поля не нарушается.
+        table = self.model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {table} SET amount = CASE '
+                f'WHEN {table}.amount > cart.amount '
+                f'THEN {table}.amount - cart.amount ELSE 0 END '
+                f'FROM ({sql}) cart '
+                f'WHERE {table}.user_id = cart.user_id '
+                f'AND {table}.ingredients_id = cart.ingredients_id',
+                params
+            )
+        stale = self.filter(
+            amount__lte=0,
+            ingredients__ingredients_recipe__recipe__in=recipe_ids
+        )
+        if user_id is not None:
+            stale = stale.filter(user_id=user_id)
+        stale.delete()
+
+    def rebuild(self):
+        """Пересчитывает списки покупок всех пользователей."""
+        sql, params = self._cart_ingredients()
+        self.all().delete()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {self.model._meta.db_table} '
+                f'(user_id, ingredients_id, amount) {sql}',
+                params
+            )
+
+    def expected(self):
+        """Возвращает списки покупок, рассчитанные по корзинам."""
+        sql, params = self._cart_ingredients()
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return {
+                (user_id, ingredients_id): amount
+                for user_id, ingredients_id, amount in cursor.fetchall()
+            }
+
+
+class ShoppingListIngredient(models.Model):
+    user = models.ForeignKey(
+        FoodgramUser,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+    )
+    ingredients = models.ForeignKey(
+        Ingredients,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+    )
+    amount = models.PositiveIntegerField('Количество')
+
+    objects = ShoppingListIngredientManager()
+
+    class Meta:
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Ингредиенты в списках покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'ingredients',),
+                name='unique_shopping_list_ingredient'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user} - {self.ingredients}'
@@ -0,0 +1,17 @@
+'use strict';
+{
+    const $ = django.jQuery;
+
+    $(function() {
+        // Выбор в фильтре AutocompleteFilter перезагружает список
+        // с параметром фильтра, очистка поля - без него.
+        $('.autocomplete-filter select').on('change', function() {
+            const filter = this.closest('.autocomplete-filter');
+            const params = new URLSearchParams(filter.dataset.queryString);
+            if (this.value) {
+                params.set(filter.dataset.lookup, this.value);
+            }
+            window.location.search = params.toString();
+        });
+    });
+}
@@ -1,22 +1,52 @@
 from django.contrib import admin
 
+from recipes.admin_utils import AutocompleteFilter, LargeTableAdmin
+from recipes.counters import delete_users, refresh_counter
 from recipes.models import Subsription
 
 from .models import FoodgramUser
 
 
-class FoodgramUserAdmin(admin.ModelAdmin):
-    list_display = ('username', 'email', 'first_name', 'last_name')
-    list_filter = ('username', 'email')
-    search_fields = ('username', 'email')
-    empty_value_display = '-пусто-'
+class FoodgramUserAdmin(LargeTableAdmin):
+    list_display = (
+        'username', 'email', 'first_name', 'last_name', 'recipes_count',
+        'subscribers_count'
+    )
+    list_filter = ('is_staff', 'is_active')
+    search_fields = ('^username', '^email')
+    readonly_fields = ('recipes_count', 'subscribers_count')
 
+    def delete_model(self, request, obj):
+        delete_users(FoodgramUser.objects.filter(pk=obj.pk))
 
-class SubsriptionAdmin(admin.ModelAdmin):
+    def delete_queryset(self, request, queryset):
+        delete_users(queryset)
+
+
+class SubsriptionAdmin(LargeTableAdmin):
     list_display = ('user', 'author')
-    list_filter = ('user', 'author')
-    search_fields = ('user', 'author')
-    empty_value_display = '-пусто-'
+    list_select_related = ('user', 'author')
+    list_filter = (
+        ('user', AutocompleteFilter), ('author', AutocompleteFilter)
+    )
+    search_fields = ('^user__username', '^author__username')
+    autocomplete_fields = ('user', 'author')
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        authors = {obj.author_id}
+        if change and 'author' in form.changed_data:
+            authors.add(form.initial['author'])
+        refresh_counter('subscribers_count', authors)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        refresh_counter('subscribers_count', {obj.author_id})
+
+    def delete_queryset(self, request, queryset):
+        authors = set(queryset.values_list('author_id', flat=True))
+        super().delete_queryset(request, queryset)
+        refresh_counter('subscribers_count', authors)
 
 
 admin.site.register(Subsription, SubsriptionAdmin)
@@ -0,0 +1,167 @@
+import csv
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from foodgram.settings import BASE_DIR
+from users.models import FoodgramUser
+
+DATE_FORMATS = ('%Y-%m-%d %H:%M:%S.%f %z', '%d/%m/%Y', '%Y-%m-%d')
+BOOLEAN_FIELDS = ('is_superuser', 'is_staff', 'is_active')
+TEXT_FIELDS = ('username', 'first_name', 'last_name', 'email')
+
+
+def parse_date(value):
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        for date_format in DATE_FORMATS:
+            try:
+                parsed = datetime.strptime(value, date_format)
+                break
+            except ValueError:
+                continue
+        else:
+            raise CommandError(f'Некорректная дата: {value}')
+    if settings.USE_TZ and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone.utc)
+    return parsed
+
+
+def check_hashed(password):
+    """Проверяет, что пароль уже захеширован известным алгоритмом."""
+    if not password:
+        return make_password(None)
+    try:
+        identify_hasher(password)
+    except ValueError:
+        raise CommandError(
+            'Пароль не похож на хеш Django, '
+            'запустите команду без --pre-hashed.'
+        )
+    return password
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает пользователей из CSV пакетами. Пароли хешируются '
+        'параллельно в пуле процессов; уже существующие пользователи '
+        'пропускаются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file',
+            type=Path,
+            default=BASE_DIR / 'data' / 'users.csv',
+            help='CSV-файл с пользователями.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Количество пользователей в одном пакете.',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Количество процессов для хеширования паролей.',
+        )
+        parser.add_argument(
+            '--pre-hashed',
+            action='store_true',
+            help='Пароли в файле уже захешированы, сохранять как есть.',
+        )
+
+    def read_batches(self, path, size):
+        with open(path, encoding='utf-8') as file:
+            reader = csv.DictReader(file)
+            while True:
+                batch = list(islice(reader, size))
+                if not batch:
+                    return
+                yield batch
+
+    def make_user(self, row, password):
+        user = FoodgramUser(
+            password=password,
+            last_login=parse_date(row.get('last_login')),
+            date_joined=parse_date(row.get('date_joined')) or timezone.now(),
+            **{field: row[field] for field in TEXT_FIELDS},
+            **{
+                field: row.get(field, '').lower() == 'true'
+                for field in BOOLEAN_FIELDS
+            }
+        )
+        if 'is_active' not in row:
+            user.is_active = True
+        return user
+
+    def hash_passwords(self, executor, rows, pre_hashed):
+        passwords = [row['password'] or None for row in rows]
+        if pre_hashed:
+            return [check_hashed(password) for password in passwords]
+        if executor is None:
+            return [make_password(password) for password in passwords]
+        return list(executor.map(
+            make_password,
+            passwords,
+            chunksize=max(1, len(passwords) // (self.workers * 4))
+        ))
+
+    def handle(self, *args, **options):
+        self.workers = max(1, options['workers'])
+        pre_hashed = options['pre_hashed']
+        executor = None
+        if not pre_hashed and self.workers > 1:
+            # Процессы запускаются через spawn: каждый из них — новый
+            # интерпретатор, который не наследует сокет соединения с БД.
+            # Пул создаёт процессы по мере надобности, в том числе внутри
+            # транзакции, и это безопасно при любом способе запуска.
+            executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup,
+            )
+        started = time.monotonic()
+        total = 0
+        try:
+            with transaction.atomic():
+                for rows in self.read_batches(
+                    options['file'], options['batch_size']
+                ):
+                    passwords = self.hash_passwords(
+                        executor, rows, pre_hashed
+                    )
+                    FoodgramUser.objects.bulk_create(
+                        (
+                            self.make_user(row, password)
+                            for row, password in zip(rows, passwords)
+                        ),
+                        ignore_conflicts=True
+                    )
+                    total += len(rows)
+                    elapsed = time.monotonic() - started
+                    self.stdout.write(
+                        f'users: {total} rows in {elapsed:.2f}s '
+                        f'({total / elapsed if elapsed else total:.0f} '
+                        f'rows/s)'
+                    )
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        self.stdout.write(self.style.SUCCESS('Users imported successfully'))
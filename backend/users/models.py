@@ -17,6 +17,12 @@ class FoodgramUser(AbstractUser):
     first_name = models.CharField('Имя', max_length=MAX_LENGTH_USER_FIELDS)
     last_name = models.CharField('Фамилия', max_length=MAX_LENGTH_USER_FIELDS)
     password = models.CharField('Пароль', max_length=MAX_LENGTH_USER_FIELDS)
+    recipes_count = models.PositiveIntegerField(
+        'Рецептов', default=0, editable=False
+    )
+    subscribers_count = models.PositiveIntegerField(
+        'Подписчиков', default=0, editable=False
+    )
 
     class Meta:
         ordering = ('username',)